@@ -12,13 +12,13 @@ def TWCC_LOGO():
     )
 TWCC_LOGO() ## here is logo
 import re
-from twcc.util import pp, table_layout, SpinCursor, isNone
+from twcc.util import pp, table_layout, SpinCursor, isNone, parallel_map
 from twcc.services.solutions import solutions
 from twcc.services.base import acls, users, image_commit
 from twcc.services.projects import projects
 from twcc.session import session_start
 from twcc.services.compute import sites
-from prompt_toolkit.shortcuts import get_input
+from twcc import cache
 import click,os
 import time
 
@@ -35,23 +35,40 @@ def list_projects():
 @click.command()
 @click.option('-sol', '--solution-name','solution_name', default=None,
         help="Show images under TWCC solutions, ie. 'Custom Image' ")
-def list_all_img(solution_name):
-    print("NOTE: This operation will take 1~2 mins.")
+@click.option('--refresh', 'refresh', is_flag = True, help = "Ignore cached solutions and images.")
+@click.option('-workers', 'max_workers', default = 8, type = int, help = "Number of solutions to query at the same time")
+@click.option('-timing', 'isTiming', is_flag = True, help = "Show latency of every request and in total.")
+def list_all_img(solution_name, refresh, max_workers, isTiming):
+    if refresh:
+        cache.clear('solutions', 'site_extra_prop', 'http')
+    start_time = time.time()
     a = solutions()
     if isNone(solution_name):
         cntrs = [(cntr['name'], cntr['id']) for cntr in a.list() if not cntr['id'] in block_set]
     else:
         cntrs = [(cntr['name'], cntr['id']) for cntr in a.list() if not cntr['id'] in block_set and cntr['name'].lower()==solution_name.lower()]
 
-    sol_list = sites.getSolList(name_only=True)
-    base_site = sites(debug=False)
+    # sites keeps per-call state, one object for each request
+    def _get_imgs(cntr):
+        (sol_name, sol_id) = cntr
+        t_start = time.time()
+        imgs = sites(debug=False).getAvblImg(sol_id, sol_name)
+        return (imgs, time.time() - t_start)
+
     output = []
-    for (sol_name, sol_id) in cntrs:
+    for ((sol_name, sol_id), res, err) in parallel_map(_get_imgs, cntrs, max_workers=max_workers):
+        if not isNone(err):
+            raise err
+        (imgs, cost) = res
+        if isTiming:
+            print("- {0} ({1}): {2:.3f} sec".format(sol_name, sol_id, cost))
         output.append( {"sol_name":sol_name,
             "sol_id":sol_id,
-            "images":list(set(base_site.getAvblImg(sol_id, sol_name)))} )
+            "images":sorted(set(imgs), reverse=True)} )
 
     table_layout("img", output, ['sol_name', 'sol_id', 'images'])
+    if isTiming:
+        print("- total: {0:.3f} sec for {1} solutions".format(time.time() - start_time, len(cntrs)))
 
 @click.command()
 def list_s3():
@@ -59,55 +76,162 @@ def list_s3():
     print(b.getAvblS3())
 
 
-def doSiteReady(site_id):
+def doSitesReady(site_ids, timeout=1800):
     b = sites(debug=False)
-    wait_ready = False
-    while not wait_ready:
-        print("Waiting for container to be Ready.")
-        if b.isReady(site_id):
-            wait_ready = True
-        time.sleep(5)
+    print("Waiting for {} container(s) to be Ready.".format(len(site_ids)))
+    failed = set()
+    def _report(site_id, sec, status):
+        if status == "Ready":
+            print("Site id: {0} is Ready, {1:.1f} sec.".format(site_id, sec))
+        else:
+            failed.add(site_id)
+            print("Site id: {0} will not be Ready, status: {1}.".format(
+                site_id, "not found" if isNone(status) else status))
+    ready = b.waitReady(site_ids, timeout=timeout, callback=_report)
+    for site_id in site_ids:
+        if isNone(ready[site_id]) and not site_id in failed:
+            print("Site id: {0} is not Ready after {1} sec.".format(site_id, timeout))
+    return ready
+
+def doSiteReady(site_id):
+    doSitesReady([site_id])
     return site_id
 
-@click.command()
-@click.option('-cntr', 'cntr_name', default = "twcc-cli", type = str, help = "Enter containr name")
-@click.option('-gpu', default = '1m', type = str, help = "Enter number of gpu")
-@click.option('-sol', 'sol_name', default = "CUDA", type = str, help = "Enter solution name")
-@click.option('-img', 'sol_img', default = 'cuda-10.1-cudnn7-devel-ubuntu18.04:latest', type = str, help = "Enter image name")
-#@click.option('-s3','s3', default = [], multiple = True, help = "Enter S3 bucket") # dont use
-@click.option('-wait', 'isWait', default = True, type = bool,  help = "Need to wait for cntr")
-def create_cntr(cntr_name, gpu, sol_name, sol_img, isWait):
+def mk_cntr_header(b, sol_ids, gpu, sol_name, sol_img):
+    """ check gpu/solution/image of a container, return (sol_id, extra_prop)
+    """
     def_header = sites.getGpuDefaultHeader(gpu)
-    a = solutions()
-    cntrs = dict([(cntr['name'], cntr['id']) for cntr in a.list() if not cntr['id'] in block_set and cntr['name']==sol_name])
-    if len(cntrs)>0:
-        sol_id = cntrs[sol_name]
+    if sol_name in sol_ids:
+        sol_id = sol_ids[sol_name]
     else:
         raise ValueError("Solution name '{0}' for '{1}' is not valid.".format(sol_img, sol_name))
 
-    b = sites(debug=False)
     imgs = b.getAvblImg(sol_id, sol_name, latest_first=True)
-    if type(sol_img) == type(None) or len(sol_name)==0:
+    if type(sol_img) == type(None) or len(sol_img)==0:
         def_header['x-extra-property-image'] = imgs[0]
     else:
         if sol_img in imgs:
             def_header['x-extra-property-image'] = sol_img
         else:
             raise ValueError("Container image '{0}' for '{1}' is not valid.".format(sol_img, sol_name))
+    return (sol_id, def_header)
 
-    res = b.create(cntr_name, sol_id, def_header)
-
+def chk_site_id(res):
     if 'id' not in res.keys():
         if 'message' in res:
             raise ValueError("Can't find id, please check error message : {}".format(res['message']))
         if 'detail' in res:
             raise ValueError("Can't find id, please check error message : {}".format(res['detail']))
-    else:
-        print("Site id: {0} is created.".format(res['id']))
+        raise ValueError("Can't find id in response : {}".format(res))
+    return int(res['id'])
+
+def load_cntr_manifest(fn):
+    """ containers to create, YAML or JSON
+
+    a list (or {'containers': [...]}) of entries with keys
+    name, gpu, sol, img and num, missing keys use command line values.
+    A missing name is the -cntr name with the entry number, a missing
+    img is -img for entries of the -sol solution, else the latest image.
+    """
+    import yaml
+    with open(fn, 'r') as fp:
+        manifest = yaml.safe_load(fp)
+    if type(manifest) == type({}):
+        manifest = manifest['containers']
+    return manifest
+
+def create_cntrs(entries, max_workers=8, isWait=True, out_fn=None):
+    # validate every solution and image once, before creating anything
+    a = solutions()
+    sol_ids = dict([(cntr['name'], cntr['id']) for cntr in a.list() if not cntr['id'] in block_set])
+    b = sites(debug=False)
+    checked = {}
+    specs = []
+    for ent in entries:
+        key = (ent['sol'], ent.get('img'))
+        if not key in checked:
+            checked[key] = mk_cntr_header(b, sol_ids, str(ent['gpu']), ent['sol'], ent.get('img'))
+        sol_id = checked[key][0]
+        def_header = sites.getGpuDefaultHeader(str(ent['gpu']))
+        def_header['x-extra-property-image'] = checked[key][1]['x-extra-property-image']
+        num = int(ent.get('num', 1))
+        for idx in range(num):
+            specs.append({'name': ent['name'] if num==1 else "{}-{}".format(ent['name'], idx+1),
+                          'gpu': str(ent['gpu']),
+                          'sol': ent['sol'],
+                          'img': def_header['x-extra-property-image'],
+                          'sol_id': sol_id,
+                          'extra_prop': def_header})
+
+    results = []
+    for (spec, res, err) in b.create_many(specs, max_workers=max_workers):
+        out = dict([(k, spec[k]) for k in ['name', 'gpu', 'sol', 'img']])
+        out.update({'id': None, 'ready_sec': None, 'error': None})
+        try:
+            if isNone(err):
+                out['id'] = chk_site_id(res)
+                print("Site id: {0} is created.".format(out['id']))
+        except ValueError as e:
+            err = e
+        if not isNone(err):
+            out['error'] = str(err)
+            print("Failed to create {}: {}".format(spec['name'], err))
+        results.append(out)
+
+    site_ids = [x['id'] for x in results if not isNone(x['id'])]
+    if isWait and len(site_ids)>0:
+        ready = doSitesReady(site_ids)
+        for x in results:
+            if not isNone(x['id']):
+                x['ready_sec'] = ready[x['id']]
+
+    if not isNone(out_fn):
+        import json
+        with open(out_fn, 'w') as fp:
+            json.dump(results, fp, indent=2)
+        print("Results are written to {}".format(out_fn))
+    return results
+
+@click.command()
+@click.option('-cntr', 'cntr_name', default = "twcc-cli", type = str, help = "Enter containr name")
+@click.option('-gpu', default = '1m', type = str, help = "Enter number of gpu")
+@click.option('-sol', 'sol_name', default = "CUDA", type = str, help = "Enter solution name")
+@click.option('-img', 'sol_img', default = 'cuda-10.1-cudnn7-devel-ubuntu18.04:latest', type = str, help = "Enter image name")
+#@click.option('-s3','s3', default = [], multiple = True, help = "Enter S3 bucket") # dont use
+@click.option('-wait', 'isWait', default = True, type = bool,  help = "Need to wait for cntr")
+@click.option('-num', 'num', default = 1, type = int, help = "Number of identical containers to create")
+@click.option('-manifest', 'manifest', default = None, type = str, help = "YAML/JSON file listing containers to create")
+@click.option('-workers', 'max_workers', default = 8, type = int, help = "Number of containers to create at the same time")
+@click.option('-out', 'out_fn', default = None, type = str, help = "Write JSON results of a batch create to this file")
+@click.option('--refresh', 'refresh', is_flag = True, help = "Ignore cached solutions and images.")
+def create_cntr(cntr_name, gpu, sol_name, sol_img, isWait, num, manifest, max_workers, out_fn, refresh):
+    if refresh:
+        cache.clear('solutions', 'site_extra_prop', 'http')
+    if num>1 or not isNone(manifest):
+        entries = [{'name': cntr_name, 'gpu': gpu, 'sol': sol_name, 'img': sol_img, 'num': num}]
+        if not isNone(manifest):
+            entries = []
+            for (idx, ent) in enumerate(load_cntr_manifest(manifest)):
+                # unnamed entries must not share one name
+                entries.append({'name': "{}-{}".format(cntr_name, idx+1), 'gpu': gpu, 'sol': sol_name})
+                entries[-1].update(ent)
+                if not 'img' in ent and entries[-1]['sol'] == sol_name:
+                    entries[-1]['img'] = sol_img
+        return create_cntrs(entries, max_workers=max_workers, isWait=isWait, out_fn=out_fn)
+
+    a = solutions()
+    sol_ids = dict([(cntr['name'], cntr['id']) for cntr in a.list() if not cntr['id'] in block_set and cntr['name']==sol_name])
+
+    b = sites(debug=False)
+    (sol_id, def_header) = mk_cntr_header(b, sol_ids, gpu, sol_name, sol_img)
+
+    res = b.create(cntr_name, sol_id, def_header)
+    site_id = chk_site_id(res)
+    print("Site id: {0} is created.".format(site_id))
 
     if isWait:
-        doSiteReady(res['id'])
-    return int(res['id'])
+        doSiteReady(site_id)
+    return site_id
 
 
 def list_all_solutions():
@@ -123,9 +247,18 @@ def list_sol():
     avbl_sols = sites.getSolList(mtype='list', name_only=True)
     print(avbl_sols)
 
-def del_all():
+def show_del_results(results):
+    for (con_id, res, err) in results:
+        if isNone(err):
+            print("Successfully remove {}".format(con_id))
+        else:
+            print("Failed to remove {}: {}".format(con_id, err))
+    return results
+
+def del_all(max_workers=8):
     a = sites()
-    [ a.delete(site_info['id']) for site_info in a.list()]
+    return show_del_results(a.delete_many([site_info['id'] for site_info in a.iter_list()],
+                                          max_workers=max_workers))
 
 def get_all_info():
     a = sites()
@@ -137,14 +270,13 @@ def get_site_detail(site_id):
 
 @click.command()
 @click.argument('con_ids', nargs=-1)
-def del_cntr(con_ids):
+@click.option('-p', '--parallel', 'max_workers', default = 8, type = int, help = "Number of containers to delete at the same time")
+def del_cntr(con_ids, max_workers):
     a = sites()
     if type(con_ids) == type(1):
         con_ids = [con_ids]
     if len(list(con_ids)) > 0:
-        for con_id in con_ids:
-            a.delete(con_id)
-            print("Successfully remove {}".format(con_id))
+        show_del_results(a.delete_many(list(con_ids), max_workers=max_workers))
     else:
         print("Need to enter Container ID")
 
@@ -187,6 +319,7 @@ def list_commit():
 
 @click.command()
 def create_commit():
+    from prompt_toolkit.shortcuts import get_input
     a = sites()
     isAll = True;
 
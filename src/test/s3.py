@@ -10,16 +10,41 @@ def TWCC_LOGO():
         colored('TWCC.ai', 'white', attrs=['reverse', 'blink']),
         colored(" "+"<"*10, 'yellow')
     )
-TWCC_LOGO() ## here is logo
+if sys.stdout.isatty():
+    TWCC_LOGO() ## here is logo, not mixed into piped output like download -d -
 import re
-from twcc.services.s3_tools import S3
-
 import click,time
 
+def S3():
+    # boto3 is slow to import, only load it when a command runs, not for --help
+    from twcc.services.s3_tools import S3
+    return S3()
+
 @click.group()
 def cli():
     pass
 
+def transfer_options(f):
+    """ boto3 TransferConfig options shared by upload and download
+    """
+    f = click.option('--max-bandwidth','max_bandwidth',default=None,type=float,help='Bandwidth limit in MB/s, needs a boto3 newer than 1.9.63.')(f)
+    f = click.option('--concurrency','max_concurrency',default=None,type=int,help='Number of threads for one file.')(f)
+    f = click.option('--chunksize','multipart_chunksize',default=None,type=float,help='Size in MB of each multipart part.')(f)
+    f = click.option('--multipart-threshold','multipart_threshold',default=None,type=float,help='Size in MB to start multipart transfer.')(f)
+    return f
+
+def copy_options(f):
+    """ source and destination options shared by copy and move
+    """
+    f = click.option('--retries','retries',default=2,type=int,help = 'Retries for each failed file.')(f)
+    f = click.option('-w','--workers','max_workers',default=8,type=int,help = 'Number of files to copy at the same time with -r.')(f)
+    f = click.option('-r','r',is_flag = True,help = 'Every file starting with the key.')(f)
+    f = click.option('-t','--target','target',help = 'Key in the destination, same as --key if not set.')(f)
+    f = click.option('-d','--destination','destination',help = 'Name of the destination Bucket, same as --source if not set.')(f)
+    f = click.option('-k','--key','key',required=True,help = 'The name of the key, a folder with -r.')(f)
+    f = click.option('-s','--source','source',required=True,help = 'Name of the Bucket.')(f)
+    return f
+
 # Bucket functions
 @click.command()
 @click.option('-n','--name','bucket_name',required=True,type=str,help='Name of the Bucket')
@@ -51,77 +76,152 @@ def del_bucket(bucket_name,df):
 # File functions
 @click.command()
 @click.option('-n','--name','bucket_name',required=True, help = 'Name of the Bucket.')
-def list_files(bucket_name):
+@click.option('-p','--prefix','prefix',default='', help = 'Only list files starting with this prefix.')
+@click.option('--stream','stream',is_flag = True, help = 'Print rows as they are listed instead of one table, for large buckets.')
+def list_files(bucket_name,prefix,stream):
     ''' List all the exist files inside the s3 bucket.
     '''
     s3 = S3()
-    files = s3.list_object(bucket_name)
-    s3.test_table(files)
+    if stream:
+        head_data = ['LastModified', 'Size', 'StorageClass', 'Key']
+        print("\t".join(head_data))
+        for obj in s3.iter_objects(bucket_name, prefix=prefix):
+            print("\t".join([str(x) for x in s3.object_row(obj, head_data)]))
+    else:
+        files = s3.list_object(bucket_name, prefix=prefix)
+        s3.test_table(files)
 
 @click.command()
 @click.option('-n','--name','bucket_name',required=True, help = 'Name of the Bucket.')
-@click.option('-f','--file_name','file_name',required=True, help = 'Name of the File.')
-def del_file(bucket_name,file_name):
+@click.option('-f','--file_name','file_name', help = 'Name of the File.')
+@click.option('-p','--prefix','prefix', help = 'Delete every file starting with this prefix.')
+@click.option('-w','--workers','max_workers',default=8,type=int,help = 'Number of delete requests at the same time with -p.')
+def del_file(bucket_name,file_name,prefix,max_workers):
     ''' Delete file from s3 bucket
     '''
     s3 = S3()
-    s3.del_object(bucket_name,file_name)
+    if not prefix == None:
+        s3.del_objects(bucket_name, (obj['Key'] for obj in s3.iter_objects(bucket_name, prefix=prefix)),
+                       max_workers=max_workers)
+    elif not file_name == None:
+        s3.del_object(bucket_name,file_name)
+    else:
+        raise Exception("Need to set --file_name or --prefix")
 
 @click.command()
-@click.option('-s','--source','source',required=True, help = 'Name of the File.')
+@click.option('-s','--source','source',required=True, help = 'Name of the File, - for stdin.')
 @click.option('-d','--directory','directory',required=True, help = 'Name of the Bucket.')
 @click.option('-k','--key','key',help ='The name of the key to upload to.') 
 @click.option('-r','r',is_flag = True,help = 'Recursively copy entire directories.' )
-def upload(source,directory,key,r):
+@click.option('-w','--workers','max_workers',default=8,type=int,help = 'Number of files to upload at the same time with -r.')
+@click.option('--retries','retries',default=2,type=int,help = 'Retries for each failed file with -r.')
+@click.option('--resume/--no-resume','resume',default=True,help = 'Keep the state of a large file upload, so a rerun continues where it stopped.')
+@click.option('--buffer-parts','buffer_parts',default=8,type=int,help = 'Parts kept in memory when streaming with -.')
+@transfer_options
+def upload(source,directory,key,r,max_workers,retries,resume,buffer_parts,multipart_threshold,multipart_chunksize,max_concurrency,max_bandwidth):
     ''' Upload to s3 bucket
     '''
     s3 = S3()
+    s3.set_transfer_config(multipart_threshold,multipart_chunksize,max_concurrency,max_bandwidth)
     # Check for source type
-    if os.path.isdir(source):
+    if source == '-':
+        if key == None:
+            raise Exception("Need to set --key when uploading from stdin")
+        s3.upload_stream(getattr(sys.stdin, 'buffer', sys.stdin),directory,key,
+                         buffer_parts=buffer_parts,retries=retries)
+    elif os.path.isdir(source):
         if r != True:
             raise Exception("{} is path, need to set recursive to True".format(source))
-        s3.upload_bucket(path = source ,bucket_name = directory,r=r)
+        s3.upload_bucket(path = source ,bucket_name = directory,r=r,max_workers=max_workers,retries=retries)
     else:
         if key == None:
             key = source.split('/')[-1]
-        s3.upload_bucket(file_name = source ,bucket_name = directory,key = key)
+        s3.upload_bucket(file_name = source ,bucket_name = directory,key = key,retries=retries,resume=resume)
 
 #download_bucket(self,bucket_name=None,key=None,file_name=None,path=None,r=False)
 @click.command()
 @click.option('-s','--source','source',required=True, help = 'Name of the Bucket.')
-@click.option('-d','--directory','directory',required=True, help = 'Name of the path.')
+@click.option('-d','--directory','directory',required=True, help = 'Name of the path, - for stdout.')
 @click.option('-k','--key','key',help ='The name of the key to download.') 
 @click.option('-r','r',is_flag = True,help = 'Recursively copy entire directories.' )
-def download(source,directory,key,r):
+@click.option('-w','--workers','max_workers',default=8,type=int,help = 'Number of files to download at the same time.')
+@click.option('--retries','retries',default=2,type=int,help = 'Retries for each failed file.')
+@click.option('--resume/--no-resume','resume',default=True,help = 'Keep the state of a large file download, so a rerun continues where it stopped.')
+@click.option('--buffer-parts','buffer_parts',default=8,type=int,help = 'Parts kept in memory when streaming with -.')
+@transfer_options
+def download(source,directory,key,r,max_workers,retries,resume,buffer_parts,multipart_threshold,multipart_chunksize,max_concurrency,max_bandwidth):
     ''' Download from s3 bucket
     '''
     s3 = S3()
+    s3.set_transfer_config(multipart_threshold,multipart_chunksize,max_concurrency,max_bandwidth)
     # Check for source type 
     if not s3.check_4_bucket(source):
         raise Exception("No such bucket name {} exists".format(source))
 
+    if directory == '-':
+        if key == None:
+            raise Exception("Need to set --key when downloading to stdout")
+        s3.download_stream(source,key,getattr(sys.stdout, 'buffer', sys.stdout),
+                           buffer_parts=buffer_parts,retries=retries)
+        return
+
     # Check if the directory exists
     # Download everything inside the bucket
     if os.path.isdir(directory) and key == None:
         if r != True:
             raise Exception("{} is path, need to set recursive to True".format(directory))
-        s3.download_bucket(bucket_name = source,path=directory,r=r)
+        s3.download_bucket(bucket_name = source,path=directory,r=r,max_workers=max_workers,retries=retries)
     else:
         # Download everthing from a folder
         if key.endswith('*'):
-            files = s3.list_object(source)
             prefix_folder = '/'.join(key.split('/')[:-1])
-            desire_files = s3.list_files_v2(bucket_name=source,delimiter='',prefix=prefix_folder)
-            for desire_file in desire_files:
-                if not desire_file.endswith('/'):
-                    print(desire_file)    
-                    new_directory = directory + desire_file
-                    s3.download_bucket(file_name = new_directory,bucket_name = source,key = desire_file)
+            s3.download_bucket(bucket_name = source,path=directory,r=True,prefix=prefix_folder,
+                               max_workers=max_workers,retries=retries)
         else:
         # Download a single file from a folder or bucket
             if directory.endswith('/'):
                 directory = directory + key
-            s3.download_bucket(file_name = directory,bucket_name = source,key = key)
+            s3.download_bucket(file_name = directory,bucket_name = source,key = key,retries=retries,resume=resume)
+
+@click.command()
+@click.option('-l','--local','path',required=True, help = 'Local directory.')
+@click.option('-n','--name','bucket_name',required=True, help = 'Name of the Bucket.')
+@click.option('-p','--prefix','prefix',default='', help = 'Folder inside the bucket.')
+@click.option('--download','download',is_flag = True,help = 'Sync from the bucket to the local directory.')
+@click.option('--delete','delete',is_flag = True,help = 'Delete files in the destination which are not in the source.')
+@click.option('--dryrun','dryrun',is_flag = True,help = 'Show what would be transferred and deleted.')
+@click.option('--manifest','manifest',is_flag = True,help = 'Cache local file hashes between runs.')
+@click.option('-w','--workers','max_workers',default=8,type=int,help = 'Number of files to transfer at the same time.')
+@click.option('--retries','retries',default=2,type=int,help = 'Retries for each failed file.')
+@transfer_options
+def sync(path,bucket_name,prefix,download,delete,dryrun,manifest,max_workers,retries,
+         multipart_threshold,multipart_chunksize,max_concurrency,max_bandwidth):
+    ''' Sync a local directory and a s3 bucket, only new and changed files are transferred
+    '''
+    s3 = S3()
+    s3.set_transfer_config(multipart_threshold,multipart_chunksize,max_concurrency,max_bandwidth)
+    if not s3.check_4_bucket(bucket_name):
+        raise Exception("No such bucket name {} exists".format(bucket_name))
+    s3.sync(path,bucket_name,prefix=prefix,download=download,delete=delete,dryrun=dryrun,
+            manifest=manifest,max_workers=max_workers,retries=retries)
+
+@click.command()
+@copy_options
+def copy(source,key,destination,target,r,max_workers,retries):
+    ''' Copy files inside s3, without downloading them
+    '''
+    s3 = S3()
+    s3.copy(source,key,destination or source,target or key,r=r,
+            max_workers=max_workers,retries=retries)
+
+@click.command()
+@copy_options
+def move(source,key,destination,target,r,max_workers,retries):
+    ''' Move files inside s3, without downloading them
+    '''
+    s3 = S3()
+    s3.copy(source,key,destination or source,target or key,r=r,move=True,
+            max_workers=max_workers,retries=retries)
 
 cli.add_command(create_bucket)
 cli.add_command(list_buckets)
@@ -130,6 +230,9 @@ cli.add_command(list_files)
 cli.add_command(del_file)
 cli.add_command(upload)
 cli.add_command(download)
+cli.add_command(sync)
+cli.add_command(copy)
+cli.add_command(move)
 
 if __name__ == '__main__':
     cli()
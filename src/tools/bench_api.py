@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""TWCC-CLI API Benchmark
+
+Measure per-call latency of the TWCC-CLI HTTP layer against a local stub
+server, so no API key or network access is needed.
+
+Example:
+        $ python bench_api.py -n 200 http
+
+usage: bench_api.py [-h] [-n NUM] [-d DELAY] [-c CONCURRENCY] {http,startup,aio,importtime} ...
+
+positional arguments:
+  {http,startup,aio,importtime}
+    http      fresh connection per call vs. pooled keep-alive session
+    startup   cost of building service objects on a shared session
+    aio       wall time of N blocking calls vs. N calls on the asyncio backend
+    importtime
+              wall time of `--help` for the CLI scripts, with the slowest imports
+
+"""
+from __future__ import print_function
+from os import sys, path
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ answer every request with a small json body, keeping the connection alive
+    """
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    delay = 0.0
+    body = json.dumps([{"id": 1, "name": "stub", "status": "Ready"}]).encode('utf-8')
+
+    def _reply(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        if self.delay:
+            time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_stub(delay=0.0):
+    """ start a stub api gateway on a free local port
+
+    Returns:
+        (server, host_url)
+    """
+    handler = type('Handler', (StubHandler,), {'delay': delay})
+    server = StubServer(('127.0.0.1', 0), handler)
+    th = threading.Thread(target=server.serve_forever)
+    th.daemon = True
+    th.start()
+    return server, "http://127.0.0.1:{0}".format(server.server_address[1])
+
+
+def mk_data_path(host_url):
+    """ build a throw-away TWCC_DATA_PATH whose credential points to host_url
+    """
+    data_path = tempfile.mkdtemp(prefix="twcc_bench_")
+    src_path = path.dirname(path.dirname(path.abspath(__file__)))
+    shutil.copyfile(path.join(src_path, "yaml", "NCHC_API-Test_env.yaml"),
+                    path.join(data_path, "resources"))
+    with open(path.join(data_path, "credential"), 'w') as fp:
+        fp.write("[default]\n")
+        fp.write("twcc_host={0}\n".format(host_url))
+        fp.write("twcc_api_key=twcc:00000000-0000-0000-0000-000000000000\n")
+        fp.write("twcc_proj_id=1\n")
+        fp.write("twcc_username=bench\n")
+        fp.write("twcc_s3_access_key=bench\n")
+        fp.write("twcc_s3_secret_key=bench\n")
+    os.environ['TWCC_DATA_PATH'] = data_path
+    # measure every round-trip of the client, not the rate limit or reused responses
+    os.environ.setdefault('TWCC_RATE_LIMIT', '0')
+    os.environ.setdefault('TWCC_HTTP_COALESCE', '0')
+    return data_path
+
+
+def report(title, costs):
+    costs = sorted(costs)
+    total = sum(costs)
+    print("{0:<32} n={1:<5d} total={2:8.3f}s  mean={3:7.2f}ms  p50={4:7.2f}ms  p95={5:7.2f}ms".format(
+        title, len(costs), total, 1000. * total / len(costs),
+        1000. * costs[len(costs) // 2], 1000. * costs[int(len(costs) * .95) - 1]))
+
+
+def bench_http(args):
+    import requests
+    server, host_url = start_stub(args.delay)
+    mk_data_path(host_url)
+    from twcc.services.compute import sites
+
+    url = host_url + "/api/v2/k8s-taichung-default/sites/"
+    costs = []
+    for _ in range(args.num):
+        start = time.time()
+        requests.get(url, verify=False)
+        costs.append(time.time() - start)
+    report("requests.get (no pool)", costs)
+
+    a = sites(debug=False)
+    costs = []
+    for x in range(args.num):
+        start = time.time()
+        a.queryById(x)
+        costs.append(time.time() - start)
+    report("sites.queryById (pooled)", costs)
+    server.shutdown()
+
+
+def bench_startup(args):
+    server, host_url = start_stub(args.delay)
+    mk_data_path(host_url)
+
+    start = time.time()
+    from twcc.session import session_start
+    from twcc.services.compute import sites
+    from twcc.services.solutions import solutions
+    print("import twcc services: {0:.3f}s".format(time.time() - start))
+
+    costs = []
+    for _ in range(args.num):
+        start = time.time()
+        session_start(reload=True)
+        costs.append(time.time() - start)
+    report("Session re-parse", costs)
+
+    for cls in (sites, solutions):
+        costs = []
+        for _ in range(args.num):
+            start = time.time()
+            cls(debug=False)
+            costs.append(time.time() - start)
+        report("{0}() on shared session".format(cls.__name__), costs)
+    server.shutdown()
+
+
+def bench_aio(args):
+    # without latency there is nothing to overlap
+    server, host_url = start_stub(args.delay or 0.05)
+    mk_data_path(host_url)
+    from twcc.services.compute import sites
+    from twcc.aio import AsyncService, run
+
+    a = sites(debug=False)
+    aa = AsyncService(a, max_concurrency=args.concurrency)
+    num = 1
+    while num <= args.num:
+        ids = list(range(num))
+        start = time.time()
+        for mid in ids:
+            a.queryById(mid)
+        t_seq = time.time() - start
+
+        start = time.time()
+        run(aa.gather(aa.queryById, ids))
+        t_aio = time.time() - start
+        print("N={0:<5d} blocking={1:7.3f}s  asyncio={2:7.3f}s  speedup={3:5.1f}x".format(
+            num, t_seq, t_aio, t_seq / t_aio))
+        num *= 4
+    aa.close()
+    server.shutdown()
+
+
+def bench_importtime(args):
+    # --help must not need a session, point it at a closed port anyway
+    mk_data_path("http://127.0.0.1:9")
+    src_path = path.dirname(path.dirname(path.abspath(__file__)))
+
+    for script in ("s3.py", "gpu_cntr.py"):
+        cmd = [sys.executable, path.join(src_path, "test", script), "--help"]
+        costs = []
+        for _ in range(args.runs):
+            start = time.time()
+            subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+            costs.append(time.time() - start)
+        report("{0} --help".format(script), costs)
+        p50 = 1000. * sorted(costs)[len(costs) // 2]
+        print("  p50 {0:.0f}ms, target {1:.0f}ms: {2}".format(
+            p50, args.target, "OK" if p50 <= args.target else "SLOW"))
+
+        # python 3.7+, cumulative time of the top level imports
+        proc = subprocess.Popen(cmd[:1] + ["-X", "importtime"] + cmd[1:],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        err = proc.communicate()[1].decode('utf-8', 'replace')
+        tops = []
+        for line in err.splitlines():
+            cols = line.split('|')
+            if line.startswith('import time:') and len(cols) == 3 and cols[1].strip().isdigit():
+                if not cols[2][1:].startswith(' '):
+                    tops.append((int(cols[1]), cols[2].strip()))
+        for (cum_us, name) in sorted(tops, reverse=True)[:args.top]:
+            print("  {0:8.1f}ms  {1}".format(cum_us / 1000., name))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark TWCC-CLI API calls against a local stub server')
+    parser.add_argument('-n', "--num", type=int, default=200,
+                        help='number of calls, (default: %(default)s)')
+    parser.add_argument('-d', "--delay", type=float, default=0.0,
+                        help='stub server latency in seconds, (default: %(default)s)')
+    parser.add_argument('-c', "--concurrency", type=int, default=20,
+                        help='in-flight calls for the asyncio backend, (default: %(default)s)')
+    subs = parser.add_subparsers(dest='bench')
+    subs.add_parser('http', help='fresh connection per call vs. pooled keep-alive session')
+    subs.add_parser('startup', help='cost of building service objects on a shared session')
+    subs.add_parser('aio', help='wall time of N blocking calls vs. N calls on the asyncio backend')
+    imp = subs.add_parser('importtime', help='wall time of `--help` for the CLI scripts, with the slowest imports')
+    imp.add_argument('-r', "--runs", type=int, default=10,
+                     help='runs of each script, (default: %(default)s)')
+    imp.add_argument('-t', "--target", type=float, default=150.,
+                     help='target p50 in ms, (default: %(default)s)')
+    imp.add_argument("--top", type=int, default=8,
+                     help='slowest top level imports to show, (default: %(default)s)')
+
+    args = parser.parse_args()
+    if args.bench == 'http':
+        bench_http(args)
+    elif args.bench == 'startup':
+        bench_startup(args)
+    elif args.bench == 'aio':
+        bench_aio(args)
+    elif args.bench == 'importtime':
+        bench_importtime(args)
+    else:
+        parser.print_help()
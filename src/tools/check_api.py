@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""TWCC-CLI API Checks
+
+Run behaviour checks of the TWCC-CLI HTTP layer against a local stub
+server, so no API key or network access is needed. Every check runs in
+its own process, with its own TWCC_DATA_PATH, and fails with an
+AssertionError.
+
+Example:
+        $ python check_api.py
+        $ python check_api.py aio
+
+usage: check_api.py [-h] [check [check ...]]
+
+positional arguments:
+  check       checks to run, (default: all)
+
+"""
+from __future__ import print_function
+from os import sys, path
+import argparse
+import json
+import os
+import subprocess
+import threading
+import time
+try:
+    from urllib.parse import urlparse, parse_qsl
+except ImportError:
+    from urlparse import urlparse, parse_qsl
+
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+sys.path.append(path.dirname(path.abspath(__file__)))
+
+from bench_api import StubHandler, StubServer, mk_data_path
+
+CHECKS = []
+
+
+def check(func):
+    CHECKS.append(func)
+    return func
+
+
+class ScriptedHandler(StubHandler):
+    """ answer with reply(handler) -> (status, body), every request is kept in seen
+    """
+    seen = []
+
+    def reply(self):
+        return (200, self.body)
+
+    def _reply(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        if self.delay:
+            time.sleep(self.delay)
+        self.seen.append((self.command, self.path))
+        (status, body) = self.reply()
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = _reply
+
+
+def start_scripted(reply=None, delay=0.0):
+    """ start a ScriptedHandler stub and point a new TWCC_DATA_PATH at it
+
+    Returns:
+        (server, list of (verb, path) requested)
+    """
+    attrs = {'delay': delay, 'seen': []}
+    if not reply is None:
+        attrs['reply'] = lambda handler: reply(handler)
+    handler = type('Handler', (ScriptedHandler,), attrs)
+    server = StubServer(('127.0.0.1', 0), handler)
+    th = threading.Thread(target=server.serve_forever)
+    th.daemon = True
+    th.start()
+    mk_data_path("http://127.0.0.1:{0}".format(server.server_address[1]))
+    return (server, handler.seen)
+
+
+@check
+def aio():
+    """ N calls on the asyncio backend take far less than N blocking calls
+    """
+    server = start_scripted(delay=0.05)[0]
+    from twcc.services.compute import sites
+    from twcc.aio import AsyncService, run
+
+    a = sites(debug=False)
+    aa = AsyncService(a, max_concurrency=16)
+    ids = list(range(16))
+
+    start = time.time()
+    run(aa.gather(aa.queryById, ids[:1]))
+    t_one = time.time() - start
+    start = time.time()
+    res = run(aa.gather(aa.queryById, ids))
+    t_all = time.time() - start
+    aa.close()
+    server.shutdown()
+
+    assert all([isinstance(x, list) for x in res]), res
+    # 16 calls at 16 in flight, allow a lot of slack over one call
+    assert t_all < 4 * t_one, "16 calls {0:.3f}s, 1 call {1:.3f}s".format(t_all, t_one)
+
+
+@check
+def wait_ready():
+    """ waitReady stops at once for sites in Error or missing from the list
+    """
+    sites_list = [{'id': 1, 'status': 'Ready'}, {'id': 2, 'status': 'Error'}]
+    server = start_scripted(lambda handler: (200, sites_list))[0]
+    from twcc.services.compute import sites
+
+    seen = []
+    start = time.time()
+    ready = sites(debug=False).waitReady([1, 2, 3], timeout=60,
+                                         callback=lambda *x: seen.append(x[::2]))
+    server.shutdown()
+    assert time.time() - start < 5, time.time() - start
+    assert sorted(seen) == [(1, 'Ready'), (2, 'Error'), (3, None)], seen
+    assert ready[1] >= 0 and ready[2] is None and ready[3] is None, ready
+
+
+@check
+def cache_credentials():
+    """ getS3Keys is never written to the http cache, even with a cache_ttl on projects
+    """
+    def reply(handler):
+        if handler.path.split('?')[0].endswith('/key/'):
+            return (200, {'public': {'access_key': 'AK', 'secret_key': 'NOT-ON-DISK'}})
+        return (200, [{'id': 7, 'name': 'p1'}])
+    (server, seen) = start_scripted(reply)
+    from twcc.services.base import projects
+
+    a = projects(debug=False)
+    a.twcc.routes['projects'] = a.twcc.routes['projects']._replace(cache_ttl=300)
+    for _ in range(2):
+        assert projects(debug=False).getS3Keys('p1')['public']['access_key'] == 'AK'
+    server.shutdown()
+
+    assert len([x for x in seen if x[1].endswith('/key/')]) == 2, seen
+    for (root, dirs, files) in os.walk(os.path.join(os.environ['TWCC_DATA_PATH'], "cache")):
+        for fn in files:
+            with open(os.path.join(root, fn)) as fp:
+                assert not 'NOT-ON-DISK' in fp.read(), os.path.join(root, fn)
+
+
+@check
+def cache_refresh():
+    """ clearing the solutions cache, as --refresh does, lists solutions again
+    """
+    (server, seen) = start_scripted(lambda handler: (200, [{'id': 4, 'name': 'TensorFlow'}]))
+    from twcc import cache
+    from twcc.services.solutions import solutions
+
+    solutions(debug=False).list()
+    solutions(debug=False).list()
+    assert len(seen) == 1, seen
+    cache.clear('solutions')
+    solutions(debug=False).list()
+    server.shutdown()
+    assert len(seen) == 2, seen
+
+
+@check
+def coalesce_window():
+    """ identical GETs share one request within the 'coalesce' window of their function only
+    """
+    (server, seen) = start_scripted()
+    os.environ['TWCC_HTTP_COALESCE'] = '1.0'
+    from twcc.services.compute import sites
+
+    a = sites(debug=False)
+    a.twcc.routes['sites'] = a.twcc.routes['sites']._replace(coalesce=0.2)
+    a.queryById(1)
+    a.queryById(1)
+    assert len(seen) == 1, seen
+    time.sleep(0.3)
+    a.queryById(1)
+    server.shutdown()
+    assert len(seen) == 2, seen
+
+
+@check
+def iter_list_full_pages():
+    """ iter_list ends on the 404 after an exactly full last page
+    """
+    items = [{'id': x, 'name': "p{0}".format(x)} for x in range(4)]
+
+    def reply(handler):
+        page = int(dict(parse_qsl(urlparse(handler.path).query)).get('page', 1))
+        if page > 2:
+            return (404, {'detail': 'Invalid page.'})
+        return (200, items[(page - 1) * 2:page * 2])
+    (server, seen) = start_scripted(reply)
+    from twcc.services.base import projects
+
+    a = projects(debug=False)
+    a.twcc.routes['projects'] = a.twcc.routes['projects']._replace(
+        pagination={'param': 'page', 'size_param': 'page_size', 'size': 2})
+    for prefetch in (False, True):
+        assert list(a.iter_list(prefetch=prefetch)) == items
+    server.shutdown()
+    assert len(seen) == 6, seen
+
+
+@check
+def resilience():
+    """ one breaker failure per call, a retried DELETE takes 404 as done, connect errors by type
+    """
+    import socket
+    replies = []
+    (server, seen) = start_scripted(lambda handler: replies.pop(0) if replies else (502, b''))
+    os.environ['TWCC_HTTP_BACKOFF'] = '0.01'
+    from twcc import resilience
+    from twcc.clidriver import http_session
+    sess = http_session()
+    url = "http://127.0.0.1:{0}/x/".format(server.server_address[1])
+
+    for _ in range(2):
+        assert resilience.call(sess, 'get', url).status_code == 502
+    brk = resilience.breaker("127.0.0.1:{0}".format(server.server_address[1]))
+    assert (brk.state, brk.failures) == ('closed', 2), (brk.state, brk.failures)
+    assert len(seen) == 8, seen
+
+    replies[:] = [(502, b''), (404, {'detail': 'Not found.'})]
+    assert resilience.call(sess, 'delete', url).status_code == 204
+    assert resilience.call(sess, 'delete', url).status_code == 502
+    replies[:] = [(404, {'detail': 'Not found.'})]
+    assert resilience.call(sess, 'delete', url).status_code == 404
+    server.shutdown()
+    assert resilience.default_policy() is resilience.default_policy()
+
+    sk = socket.socket()
+    sk.bind(('127.0.0.1', 0))
+    port = sk.getsockname()[1]
+    sk.close()
+    try:
+        sess.get("http://127.0.0.1:{0}/".format(port))
+    except Exception as e:
+        assert resilience._is_connect_error(e), repr(e)
+    else:
+        raise AssertionError("port {0} is open".format(port))
+
+
+@check
+def rate_limit():
+    """ no limit by default, retries take tokens, a fast fail of the breaker takes none
+    """
+    (server, seen) = start_scripted(lambda handler: (502, b''))
+    del os.environ['TWCC_RATE_LIMIT']
+    os.environ['TWCC_HTTP_BACKOFF'] = '0'
+    from twcc import ratelimit, resilience
+    from twcc.clidriver import http_session
+    sess = http_session()
+    url = "http://127.0.0.1:{0}/x/".format(server.server_address[1])
+    assert ratelimit.limiter()._global is None
+
+    taken = []
+    resilience.call(sess, 'get', url, acquire=lambda: taken.append(1))
+    assert len(taken) == 4, taken
+    brk = resilience.breaker("127.0.0.1:{0}".format(server.server_address[1]))
+    brk.state = 'open'
+    brk._opened_at = time.time()
+    try:
+        resilience.call(sess, 'get', url, acquire=lambda: taken.append(1))
+    except resilience.CircuitOpenError:
+        pass
+    server.shutdown()
+    assert len(taken) == 4, taken
+
+
+def run_all(names):
+    failed = []
+    for name in names:
+        start = time.time()
+        ret = subprocess.call([sys.executable, path.abspath(__file__), "--in-process", name])
+        print("{0:<24} {1:<6} {2:.2f}s".format(name, "OK" if ret == 0 else "FAILED", time.time() - start))
+        if not ret == 0:
+            failed.append(name)
+    return failed
+
+
+if __name__ == '__main__':
+    names = [x.__name__ for x in CHECKS]
+    parser = argparse.ArgumentParser(description='Check TWCC-CLI API calls against a local stub server')
+    parser.add_argument('checks', metavar='check', nargs='*',
+                        help='checks to run, one of {0}, (default: all)'.format(", ".join(names)))
+    parser.add_argument("--in-process", dest='in_process', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    for name in args.checks:
+        if not name in names:
+            parser.error("no check named '{0}'".format(name))
+
+    if args.in_process:
+        for name in args.checks:
+            dict([(x.__name__, x) for x in CHECKS])[name]()
+    else:
+        sys.exit(1 if len(run_all(args.checks or names)) > 0 else 0)
@@ -1,7 +1,6 @@
 # Copyright 2018 NCHC
 import os
 os.environ['LANG'] = "en_US.utf8"
-from twcc.session import session_start
 
 __version__ = '0.0.1'
 
@@ -23,8 +22,9 @@ SCALAR_TYPES = set([
 ])
 COMPLEX_TYPES = set(['structure', 'map', 'list'])
 
-__all__ = ["clidriver", "util", "services"]
+__all__ = ["clidriver", "util", "services", "cache"]
 
 os.environ['_STAGE_'] = "production"
 
-_TWCC_SESSION_ = session_start()
+# the session (credential and resources YAML) is loaded by twcc.session.session_start()
+# on the first ServiceOperation, so importing twcc stays cheap, ie. for --help
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""asyncio backend for TWCC API calls (python 3 only)
+
+Url and header building is shared with ServiceOperation, the blocking
+HTTP round-trip runs on a thread pool over the pooled keep-alive session,
+so many calls can be in flight at once with bounded concurrency.
+
+Example:
+    >>> from twcc.aio import AsyncService, run
+    >>> from twcc.services.compute import sites
+    >>> a = AsyncService(sites(), max_concurrency=20)
+    >>> details = run(a.gather(a.getDetail, site_ids))
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from twcc.clidriver import ServiceOperation
+
+
+class AsyncServiceOperation(ServiceOperation):
+
+    def __init__(self, max_concurrency=10, debug=True):
+        ServiceOperation.__init__(self, debug=debug)
+
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        # a Semaphore binds to the running loop, made per loop on first use
+        self._sem = None
+        self._sem_loop = None
+
+    async def doAPI(
+        self,
+            site_sn=None, api_host="_DEF_",
+            key_tag=None, api_key="_DEF_",
+            ctype="application/json",
+            func="_DEF_",
+            url_dict=None, data_dict=None, url_ext_get=None,
+            http='get', res_type='json'):
+
+        # built in the loop thread, before any await, so header_extra and
+        # the api_* attributes set by mkHeader/mkAPIUrl are not raced
+        (t_url, t_header) = self.mkRequest(
+            site_sn=site_sn, api_host=api_host,
+            key_tag=key_tag, api_key=api_key, ctype=ctype, func=func,
+            url_dict=url_dict, url_ext_get=url_ext_get,
+            http=http, res_type=res_type)
+
+        loop = asyncio.get_event_loop()
+        if not self._sem_loop is loop:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+            self._sem_loop = loop
+
+        async with self._sem:
+            res = await loop.run_in_executor(
+                self._executor,
+                lambda: self._do_request(func, t_url, t_header, t_data=data_dict, mtype=http))
+        return self.mkResult(res, res_type)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class AsyncService(object):
+    """ async list/queryById/delete/getDetail for a GenericService
+
+    Every call carries its own url/verb, the wrapped service object is
+    only read for its site, function name, key, ext_get and project.
+    """
+
+    def __init__(self, service, max_concurrency=10):
+        self.service = service
+        self.twcc = AsyncServiceOperation(max_concurrency=max_concurrency,
+                                          debug=service._debug_)
+        self.twcc._debug = service._debug_
+
+    async def _do_api(self, url_dic=None, ext_get=None, http='get', res_type='json'):
+        return await self.twcc.doAPI(
+            site_sn=self.service._csite_,
+            key_tag=self.service._api_key_,
+            func=self.service._func_,
+            url_dict=url_dic,
+            url_ext_get=ext_get,
+            http=http,
+            res_type=res_type)
+
+    async def list(self, ext_get=None):
+        """
+        Args:
+            ext_get (dict): get parameters, else the ext_get of the service
+                or {'project': <project of the service>} like sites.list
+        """
+        if ext_get is None:
+            ext_get = self.service.ext_get
+        if ext_get is None and not self.service._project_id is None:
+            ext_get = {'project': self.service._project_id}
+        return await self._do_api(ext_get=ext_get)
+
+    async def queryById(self, mid):
+        return await self._do_api(url_dic={self.service._func_: mid})
+
+    async def delete(self, mid, res_type='txt'):
+        return await self._do_api(url_dic={self.service._func_: mid},
+                                  http='delete', res_type=res_type)
+
+    async def getDetail(self, site_id):
+        return await self._do_api(url_dic={self.service._func_: site_id,
+                                           'container': ""})
+
+    async def gather(self, func, ids, return_exceptions=True):
+        """ run func(mid) for every mid concurrently, results keep the order of ids
+        """
+        return await asyncio.gather(*[func(mid) for mid in ids],
+                                    return_exceptions=return_exceptions)
+
+    def close(self):
+        self.twcc.close()
+
+
+def run(coro):
+    """ run a coroutine to completion from blocking code
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""on-disk cache under $TWCC_DATA_PATH/cache
+
+Every entry is one JSON file, written to a temporary file first and then
+renamed into place, so readers never see a half written entry.
+"""
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+
+def cache_root():
+    return os.path.join(os.environ['TWCC_DATA_PATH'], "cache")
+
+
+def clear(*names):
+    """ drop cached entries, ie. for --refresh
+
+    Args:
+        names (str): cache names to clear, all caches if none given
+    """
+    if len(names) == 0:
+        shutil.rmtree(cache_root(), ignore_errors=True)
+    for name in names:
+        DiskCache(name).invalidate()
+
+
+class DiskCache(object):
+
+    def __init__(self, name, ttl=None):
+        """ a named cache of JSON values
+
+        Args:
+            name (str): sub directory under $TWCC_DATA_PATH/cache
+            ttl (int): seconds an entry stays valid, env TWCC_CACHE_TTL (default: 3600)
+        """
+        self.name = name
+        self.path = os.path.join(cache_root(), name)
+        if ttl is None:
+            ttl = int(os.environ.get('TWCC_CACHE_TTL', 3600))
+        self.ttl = ttl
+
+    def _fn(self, key):
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, digest + ".json")
+
+    def get(self, key, default=None, ttl=None):
+        """ value stored for key, default when missing or older than ttl
+        """
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            with open(self._fn(key), 'r') as fp:
+                ent = json.load(fp)
+        except (IOError, OSError, ValueError):
+            return default
+
+        if ttl <= 0 or time.time() - ent['ctime'] > ttl:
+            return default
+        return ent['value']
+
+    def set(self, key, value):
+        try:
+            os.makedirs(self.path)
+        except OSError as exc:
+            if not (exc.errno == errno.EEXIST and os.path.isdir(self.path)):
+                raise
+
+        (fd, tmp_fn) = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                json.dump({'ctime': time.time(), 'key': key, 'value': value}, fp)
+            _replace(tmp_fn, self._fn(key))
+        except Exception:
+            if os.path.exists(tmp_fn):
+                os.remove(tmp_fn)
+            raise
+
+    def invalidate(self, key=None):
+        """ drop one entry, or every entry of this cache when key is None
+        """
+        if key is None:
+            shutil.rmtree(self.path, ignore_errors=True)
+        elif os.path.exists(self._fn(key)):
+            os.remove(self._fn(key))
+
+
+def _replace(src, dst):
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        # python 2, rename over an existing file is atomic on POSIX only
+        try:
+            os.rename(src, dst)
+        except OSError:
+            os.remove(dst)
+            os.rename(src, dst)
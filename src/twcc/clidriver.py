@@ -1,16 +1,180 @@
 # -*- coding: utf-8 -*-
 import time
 import re
-import requests
+import hashlib
 import json
-import yaml
 import datetime
 import logging
 import os
+from twcc.cache import DiskCache
+from twcc import ratelimit, resilience
 from twcc.session import session_start
-from twcc.util import parsePtn, isNone
-import urllib3
-urllib3.disable_warnings()
+from twcc.util import isNone
+import threading
+from collections import namedtuple
+try:
+    from urllib.parse import urlencode, urlparse
+except ImportError:
+    from urllib import urlencode
+    from urlparse import urlparse
+
+# compiled entry of 'avalible_funcs', url_fmt is ready for str.format(PLATFORM=, FUNCTION=)
+# cache_ttl is seconds a GET response is served from the http cache, 0 for never
+# pagination is the page settings read by GenericService.iter_list, or None
+# rate_limit is requests per second for this function on top of the global limit, 0 for none
+# coalesce is seconds a finished GET is reused by identical GETs, None for TWCC_HTTP_COALESCE
+ApiRoute = namedtuple('ApiRoute', ['name', 'url_fmt', 'verbs', 'cache_ttl', 'pagination', 'rate_limit', 'coalesce'])
+# optional keys of a function, taken from the bundled YAML when a copied resources file has none
+_ROUTE_OPTIONS_ = ('cache_ttl', 'pagination', 'rate_limit', 'coalesce')
+# responses under these url segments hold credentials, never written to the http cache
+_NO_CACHE_SEGMENTS_ = frozenset(['key'])
+_SITE_SN_PTN_ = re.compile(r"\d+")
+
+# one keep-alive connection pool shared by every ServiceOperation
+_TWCC_HTTP_SESSION_ = None
+_TWCC_LOCK_ = threading.Lock()
+_TWCC_LOG_READY_ = False
+# expired http cache entries are kept this long for conditional GETs
+_HTTP_CACHE_KEEP_ = 7 * 24 * 3600
+
+
+def http_session(pool_size=None, reset=False):
+    """ Get the process-wide requests.Session for TWCC API calls
+
+    Connections to the api gateway are kept alive and reused, so only
+    the first call pays for the TCP+TLS handshake. Retries are left to
+    twcc.resilience, the adapter itself never retries.
+
+    Args:
+        pool_size (int): connections kept per host, env TWCC_HTTP_POOL_SIZE
+        reset (bool): close the current session and build a new one
+    """
+    global _TWCC_HTTP_SESSION_
+    with _TWCC_LOCK_:
+        if reset and not isNone(_TWCC_HTTP_SESSION_):
+            _TWCC_HTTP_SESSION_.close()
+            _TWCC_HTTP_SESSION_ = None
+
+        if isNone(_TWCC_HTTP_SESSION_):
+            # requests is slow to import, only load it for the first API call
+            import requests
+            import urllib3
+            from requests.adapters import HTTPAdapter
+            urllib3.disable_warnings()
+
+            if isNone(pool_size):
+                pool_size = int(os.environ.get('TWCC_HTTP_POOL_SIZE', 20))
+
+            adapter = HTTPAdapter(pool_connections=pool_size,
+                                  pool_maxsize=pool_size,
+                                  max_retries=0)
+            sess = requests.Session()
+            sess.verify = False
+            sess.mount('https://', adapter)
+            sess.mount('http://', adapter)
+            _TWCC_HTTP_SESSION_ = sess
+        return _TWCC_HTTP_SESSION_
+
+
+class RequestMemo(object):
+    """ collapse identical GETs into one network call
+
+    A GET which is in flight, or finished less than window seconds ago, is
+    answered with the same response, each caller still parses its own result.
+    Later GETs are sent again, for a longer reuse see the http cache.
+    """
+
+    def __init__(self, window=None):
+        """
+        Args:
+            window (float): seconds a finished GET is reused, env TWCC_HTTP_COALESCE (default: 1.0), 0 to disable
+        """
+        if isNone(window):
+            window = float(os.environ.get('TWCC_HTTP_COALESCE', 1.0))
+        self.window = window
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def get(self, key, fetch, window=None):
+        """ response of fetch(), shared by every caller of the same key within the window
+
+        Args:
+            window (float): seconds for this key, ie. the 'coalesce' of a function,
+                None for self.window. A self.window of 0 disables every key.
+        """
+        if isNone(window):
+            window = self.window
+        if self.window <= 0 or window <= 0:
+            return fetch()
+
+        with self._lock:
+            now = time.time()
+            flight = self._flights.get(key)
+            if not isNone(flight) and (not flight['done'].is_set() or now - flight['at'] <= flight['window']):
+                self.hits += 1
+                owner = False
+            else:
+                if len(self._flights) > 256:
+                    self._prune(now)
+                flight = {'done': threading.Event(), 'at': now, 'res': None, 'error': None, 'window': window}
+                self._flights[key] = flight
+                self.misses += 1
+                owner = True
+
+        if not owner:
+            flight['done'].wait()
+            if not isNone(flight['error']):
+                raise flight['error']
+            return flight['res']
+
+        try:
+            flight['res'] = fetch()
+        except Exception as e:
+            flight['error'] = e
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            raise
+        finally:
+            flight['at'] = time.time()
+            flight['done'].set()
+        return flight['res']
+
+    def _prune(self, now):
+        for key in [k for (k, v) in self._flights.items()
+                    if v['done'].is_set() and now - v['at'] > v['window']]:
+            del self._flights[key]
+
+    def clear(self):
+        with self._lock:
+            self._flights.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+# GETs of every ServiceOperation in this process are coalesced here
+_TWCC_MEMO_ = RequestMemo()
+
+
+def coalesce_stats():
+    """ {'hits': GETs answered by another call, 'misses': GETs sent} of this process
+    """
+    return _TWCC_MEMO_.stats()
+
+
+class CachedResponse(object):
+    """ the parts of requests.Response mkResult reads, rebuilt from an http cache entry
+    """
+    def __init__(self, ent):
+        self.status_code = ent['status_code']
+        self.content = ent['content'].encode('utf-8')
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
 
 class ServiceOperation:
     global _TWCC_SESSION_
@@ -26,6 +190,8 @@ class ServiceOperation:
 
         # for site usage
         self.header_extra = {}
+        # status code of the last doAPI, errors come back as responses too
+        self.status_code = None
 
         self._debug = debug
         if self._debug:
@@ -53,45 +219,80 @@ class ServiceOperation:
     def load_yaml(self):
 
         self._yaml_fn_ = self._session_.files['resources']
-        twcc_conf = yaml.load(open(self._yaml_fn_, 'r').read(), Loader=yaml.FullLoader)
         self.stage = os.environ['_STAGE_']
 
         # change to load ~/.twcc_data/credential
         #self.host_url = twcc_conf[self.stage]['host']
         #self.api_keys = twcc_conf[self.stage]['keys']
 
-        _ava_funcs_ = twcc_conf['avalible_funcs']
-
-        self.valid_funcs = [_ava_funcs_[x]['name']
-                            for x in range(len(_ava_funcs_))]
-        self.valid_http_verb = dict([(_ava_funcs_[x]['name'], _ava_funcs_[x][
-                                    'http_verb']) for x in range(len(_ava_funcs_))])
-        self.url_format = dict([(_ava_funcs_[x]['name'],
-                                 _ava_funcs_[x]['url_type']) for x in range(len(_ava_funcs_))])
-        self.url_ptn = dict([
-            (x, parsePtn(self.url_format[x])) for x in self.url_format.keys()])
-
-        self.twcc_conf = twcc_conf
+        # routes are compiled once per session and shared by every ServiceOperation
+        with _TWCC_LOCK_:
+            if not hasattr(self._session_, 'api_routes'):
+                self._session_.api_routes = self._mkRoutes(self._session_.config,
+                                                           self._bundledOptions(self._session_))
+        self.routes = self._session_.api_routes
+
+        self.twcc_conf = self._session_.config
+
+    @staticmethod
+    def _bundledOptions(sess):
+        """ {func: {option: value}} of _ROUTE_OPTIONS_ in the YAML shipped with twcc
+
+        $TWCC_DATA_PATH/resources is a copy made once, so it may be older
+        than these options. Nothing is parsed when the copy is unchanged.
+        """
+        if isNone(sess.twcc_yaml_path) or not os.path.isfile(sess.twcc_yaml_path):
+            return {}
+        with open(sess.twcc_yaml_path, 'rb') as fp:
+            shipped = fp.read()
+        with open(sess.files['resources'], 'rb') as fp:
+            if fp.read() == shipped:
+                return {}
+
+        import yaml
+        config = yaml.load(shipped, Loader=yaml.FullLoader)
+        return dict([(ava_func['name'], dict([(k, ava_func[k]) for k in _ROUTE_OPTIONS_ if k in ava_func]))
+                     for ava_func in config['avalible_funcs']])
+
+    @staticmethod
+    def _mkRoutes(twcc_conf, defaults=None):
+        """ compile 'avalible_funcs' into {func: ApiRoute}
+
+        Args:
+            twcc_conf (dict): parsed resources YAML
+            defaults (dict): {func: {option: value}} for options the YAML leaves out
+        """
+        routes = {}
+        for ava_func in twcc_conf['avalible_funcs']:
+            opts = dict((defaults or {}).get(ava_func['name'], {}))
+            opts.update([(k, ava_func[k]) for k in _ROUTE_OPTIONS_ if k in ava_func])
+            routes[ava_func['name']] = ApiRoute(
+                name=ava_func['name'],
+                url_fmt=ava_func['url_type'],
+                verbs=frozenset(ava_func['http_verb']),
+                cache_ttl=int(opts.get('cache_ttl', 0)),
+                pagination=opts.get('pagination'),
+                rate_limit=float(opts.get('rate_limit', 0)),
+                coalesce=float(opts['coalesce']) if 'coalesce' in opts else None)
+        return routes
 
     def isFunValid(self, func):
-        return True if func in self.valid_funcs else False
+        return func in self.routes
 
-    def _api_act(self, t_api, t_headers, t_data=None, mtype="get"):
+    def _api_act(self, t_api, t_headers, t_data=None, mtype="get", func=None):
 
         start_time = time.time()
-
-        if mtype == 'get':
-            r = requests.get(t_api, headers=t_headers, verify=False)
-        elif mtype == 'post':
-            r = requests.post(t_api, headers=t_headers,
-                              data=json.dumps(t_data), verify=False)
-        elif mtype == "delete":
-            r = requests.delete(t_api, headers=t_headers, verify=False)
-        elif mtype == "patch":
-            r = requests.delete(t_api, headers=t_headers, verify=False)
-        elif mtype == "put":
-            r = requests.put(t_api, headers=t_headers,
-                              data=json.dumps(t_data), verify=False)
+        sess = http_session()
+        rate = self.routes[func].rate_limit if func in self.routes else 0
+        # a token for every attempt, retries share the budget of first tries
+        acquire = lambda: ratelimit.limiter().acquire(func, rate)
+
+        # verify per call, REQUESTS_CA_BUNDLE in the environment overrides sess.verify
+        if mtype in ('get', 'delete'):
+            r = resilience.call(sess, mtype, t_api, acquire=acquire, headers=t_headers, verify=False)
+        elif mtype in ('post', 'patch', 'put'):
+            r = resilience.call(sess, mtype, t_api, acquire=acquire, headers=t_headers, verify=False,
+                                data=json.dumps(t_data))
         else:
             raise ValueError("http verb:'{0}' is not valid".format(mtype))
 
@@ -111,6 +312,84 @@ class ServiceOperation:
             url_dict=None, data_dict=None, url_ext_get=None,
             http='get', res_type='json'):
 
+        (t_url, t_header) = self.mkRequest(
+            site_sn=site_sn, api_host=api_host,
+            key_tag=key_tag, api_key=api_key, ctype=ctype, func=func,
+            url_dict=url_dict, url_ext_get=url_ext_get,
+            http=http, res_type=res_type)
+
+        res = self._do_request(func, t_url, t_header, t_data=data_dict, mtype=http)
+        self.status_code = res.status_code
+        return self.mkResult(res, res_type)
+
+    def _do_request(self, func, t_url, t_header, t_data=None, mtype="get"):
+        """ one API round-trip, GETs are coalesced and use the http cache of cached functions
+        """
+        if mtype == 'get':
+            return _TWCC_MEMO_.get((t_url, tuple(sorted(t_header.items()))),
+                                   lambda: self._get(func, t_url, t_header),
+                                   window=self.routes[func].coalesce)
+
+        r = self._api_act(t_url, t_header, t_data=t_data, mtype=mtype, func=func)[0]
+        # a change may show up in any earlier GET, cached ones of this function for sure
+        _TWCC_MEMO_.clear()
+        DiskCache("http/" + func).invalidate()
+        return r
+
+    def _get(self, func, t_url, t_header):
+        if self.routes[func].cache_ttl > 0 and not os.environ.get('TWCC_HTTP_CACHE', '1') == '0' \
+                and not _NO_CACHE_SEGMENTS_.intersection(urlparse(t_url).path.split('/')):
+            return self._cached_get(func, t_url, t_header)
+        return self._api_act(t_url, t_header, func=func)[0]
+
+    def _cached_get(self, func, t_url, t_header):
+        """ GET from $TWCC_DATA_PATH/cache/http/<func>, revalidated with ETag/Last-Modified once expired
+
+        Entries are keyed on url, api host, project and a hash of the api key,
+        so users and projects never share responses.
+        """
+        http_cache = DiskCache("http/" + func, ttl=self.routes[func].cache_ttl)
+        key = ['get', t_url, t_header.get('X-API-HOST'), self.def_proj,
+               hashlib.sha1(str(t_header.get('x-api-key')).encode('utf-8')).hexdigest(),
+               sorted(self.header_extra.items())]
+
+        ent = http_cache.get(key)
+        if not isNone(ent):
+            return CachedResponse(ent)
+
+        t_header = dict(t_header)
+        ent = http_cache.get(key, ttl=_HTTP_CACHE_KEEP_)
+        if not isNone(ent):
+            if ent['etag']:
+                t_header['If-None-Match'] = ent['etag']
+            if ent['last_modified']:
+                t_header['If-Modified-Since'] = ent['last_modified']
+
+        r = self._api_act(t_url, t_header, func=func)[0]
+        if r.status_code == 304 and not isNone(ent):
+            # unchanged, start a new ttl
+            http_cache.set(key, ent)
+            return CachedResponse(ent)
+
+        if r.status_code == 200:
+            try:
+                content = r.content.decode('utf-8')
+            except UnicodeDecodeError:
+                return r
+            http_cache.set(key, {'status_code': r.status_code, 'content': content,
+                                 'etag': r.headers.get('ETag'),
+                                 'last_modified': r.headers.get('Last-Modified')})
+        return r
+
+    def mkRequest(self,
+            site_sn=None, api_host="_DEF_",
+            key_tag=None, api_key="_DEF_",
+            ctype="application/json",
+            func="_DEF_",
+            url_dict=None, url_ext_get=None,
+            http='get', res_type='json'):
+        """ validate a doAPI call and build its (url, header)
+        """
         if not res_type in self.res_type_valid:
             raise ValueError(
                 "Response type Error:'{0}' is not valid, available options: {1}".format(
@@ -118,32 +397,28 @@ class ServiceOperation:
 
         if not self.isFunValid(func):
             raise ValueError("Function for:'{0}' is not valid".format(func))
-        if not http in set(self.valid_http_verb[func]):
+        if not http in self.routes[func].verbs:
             raise ValueError("http verb:'{0}' is not valid".format(http))
 
         t_url = self.mkAPIUrl(site_sn, api_host, func, url_dict=url_dict)
         t_header = self.mkHeader(site_sn, key_tag, api_host, api_key, ctype)
 
         if not isNone(url_ext_get):
-            t_url += "?"
-            t_url_tmp = []
-            for param_key in url_ext_get.keys():
-                t_url_tmp.append( "{0}={1}".format(param_key, url_ext_get[param_key]) )
-            t_url += "&".join(t_url_tmp)
-
-        res = self._api_act(t_url, t_header, t_data=data_dict, mtype=http)
-        if res_type in self.res_type_valid:
-            if res_type == 'json':
-                return res[0].json()
-            elif res_type == 'txt':
-                return res[0].content
+            t_url += "?" + urlencode(url_ext_get)
+        return (t_url, t_header)
+
+    def mkResult(self, r, res_type='json'):
+        if res_type == 'json':
+            return r.json()
+        elif res_type == 'txt':
+            return r.content
 
     def mkHeader(self, site_sn=None, key_tag=None,
                  api_host="_DEF_", api_key="_DEF_",
                  ctype="application/json"):
 
         if not type(site_sn) == type(None):
-            if re.match("\d+", site_sn):
+            if _SITE_SN_PTN_.match(site_sn):
                 self.api_host = self.sites[site_sn]
             else:
                 self.api_host = site_sn
@@ -167,6 +442,18 @@ class ServiceOperation:
         return return_header
 
     def _setDebug(self):
+        global _TWCC_LOG_READY_
+        # wrapper
+        self._i = logging.info
+        self._d = logging.debug
+        self._w = logging.warning
+
+        # every GenericService owns a ServiceOperation, only configure logging once
+        with _TWCC_LOCK_:
+            if _TWCC_LOG_READY_:
+                return
+            _TWCC_LOG_READY_ = True
+
         log_dir = "{}/log".format(os.environ['TWCC_DATA_PATH'])
         if not os.path.exists(log_dir):
             os.makedirs(log_dir)
@@ -190,11 +477,6 @@ class ServiceOperation:
         # 加入 hander 到 root logger
         logging.getLogger('').addHandler(console)
 
-        # wrapper
-        self._i = logging.info
-        self._d = logging.debug
-        self._w = logging.warning
-
     def show(self):
         self._i("-" * 10 + "=" * 10 + " [info] BEGIN " + "=" * 10 + "-" * 10)
         self._i(self.sites)
@@ -209,40 +491,27 @@ class ServiceOperation:
         if not self.isFunValid(func):
             raise ValueError("API Function:'{0}' is not valid".format(func))
 
-        url_ptn = self.url_ptn[func]
-        url_str = self.url_format[func]
-        url_parts = {}
-
         # check if this site_sn is valid
         if not type(site_sn) == type(None):
             self.api_pf = site_sn
         else:
             self.api_pf = api_host
 
-        if "PLATFORM" in url_ptn.keys():
-            url_parts['PLATFORM'] = self.api_pf
+        return self.host_url + self.routes[func].url_fmt.format(
+            PLATFORM=self.api_pf, FUNCTION=self.mkFuncPath(func, url_dict))
 
-        # given url_dict
-        ptn = func
-        if not type(url_dict) == type(None):
-            # check if function name is in given url_dict
-            if func in url_dict:
-                ptn = "%s/%s" % (func, url_dict[func])
-                del url_dict[func]
+    @staticmethod
+    def mkFuncPath(func, url_dict=None):
+        """ {FUNCTION} part of url, ie. {'sites': 12, 'container': ''} -> 'sites/12/container'
+        """
+        if isNone(url_dict):
+            return func
 
-                ptn += "/"+"/".join( ["%s/%s"%(k, url_dict[k]) for k in url_dict.keys()] )
-
-                #todos
-                ptn = ptn.strip("/")
-            else:
-                raise ValueError(
-                    "Can not find '{0}' in provided dictionary.".format(func))
-
-        if "FUNCTION" in url_ptn.keys():
-            url_parts["FUNCTION"] = ptn
-
-        t_url = url_str
-        for ptn in url_parts.keys():
-            t_url = t_url.replace(url_ptn[ptn], url_parts[ptn])
+        # check if function name is in given url_dict
+        if not func in url_dict:
+            raise ValueError(
+                "Can not find '{0}' in provided dictionary.".format(func))
 
-        return self.host_url + t_url
+        parts = ["{0}/{1}".format(func, url_dict[func])]
+        parts.extend(["{0}/{1}".format(k, url_dict[k]) for k in url_dict.keys() if not k == func])
+        return "/".join(parts).strip("/")
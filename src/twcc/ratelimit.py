@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""client-side token bucket rate limits for TWCC API calls
+
+Every request takes a token from the global bucket, when TWCC_RATE_LIMIT is
+set, and from the bucket of its function, when the function has a
+'rate_limit' in the resources YAML. Both are off by default.
+Buckets are shared by all threads of a process, with TWCC_RATE_SHARED=1
+also by every CLI process of the user through lock files under
+$TWCC_DATA_PATH/ratelimit.
+
+Environment:
+    TWCC_RATE_LIMIT: global requests per second, 0 for no limit (default: 0)
+    TWCC_RATE_BURST: requests sent at once before the rate applies (default: 2 * TWCC_RATE_LIMIT)
+    TWCC_RATE_SHARED: 1 to share the buckets between processes (default: 0)
+"""
+import os
+import threading
+import time
+try:
+    import fcntl
+except ImportError:
+    # no flock, ie. Windows, buckets stay per process
+    fcntl = None
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst=None):
+        """
+        Args:
+            rate (float): tokens added per second
+            burst (float): most tokens kept, rate if None
+        """
+        self.rate = float(rate)
+        self.burst = float(burst) if burst else max(1., self.rate)
+        self._tokens = self.burst
+        self._at = time.time()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens, avail, at, now):
+        # a taker may leave the bucket negative, the deficit is its wait,
+        # so waiters are served in order without polling
+        avail = min(self.burst, avail + (now - at) * self.rate) - tokens
+        return (avail, max(0., -avail / self.rate))
+
+    def _take(self, tokens):
+        with self._lock:
+            now = time.time()
+            (self._tokens, wait) = self._reserve(tokens, self._tokens, self._at, now)
+            self._at = now
+        return wait
+
+    def acquire(self, tokens=1):
+        """ block until tokens are available, returns the seconds waited
+        """
+        wait = self._take(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class FileTokenBucket(TokenBucket):
+    """ a TokenBucket kept in a file, shared by processes through flock
+    """
+
+    def __init__(self, rate, burst, path):
+        TokenBucket.__init__(self, rate, burst)
+        self.path = path
+
+    def _take(self, tokens):
+        with self._lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                now = time.time()
+                try:
+                    (avail, at) = [float(x) for x in os.read(fd, 64).decode('ascii').split()]
+                except ValueError:
+                    (avail, at) = (self.burst, now)
+                (avail, wait) = self._reserve(tokens, avail, at, now)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, "{0:.6f} {1:.6f}".format(avail, now).encode('ascii'))
+            finally:
+                # closing releases the flock
+                os.close(fd)
+        return wait
+
+
+class RateLimiter(object):
+
+    def __init__(self, rate=None, burst=None, shared=None):
+        """ a global bucket and a bucket per limited function
+
+        Args:
+            rate (float): global requests per second, env TWCC_RATE_LIMIT
+            burst (float): global burst, env TWCC_RATE_BURST
+            shared (bool): keep buckets in files for every process, env TWCC_RATE_SHARED
+        """
+        if rate is None:
+            rate = float(os.environ.get('TWCC_RATE_LIMIT', 0))
+        if burst is None:
+            burst = float(os.environ.get('TWCC_RATE_BURST', 2 * rate))
+        if shared is None:
+            shared = os.environ.get('TWCC_RATE_SHARED', '0') == '1'
+        self.shared = shared and not fcntl is None
+        self.waits = 0
+        self.waited = 0.
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._global = self._mkBucket('_global_', rate, burst)
+
+    def _mkBucket(self, name, rate, burst=None):
+        if rate <= 0:
+            return None
+        if not self.shared:
+            return TokenBucket(rate, burst)
+        path = os.path.join(os.environ['TWCC_DATA_PATH'], "ratelimit")
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                if not os.path.isdir(path):
+                    raise
+        return FileTokenBucket(rate, burst, os.path.join(path, name))
+
+    def acquire(self, func=None, rate=0):
+        """ wait for a global token and, with a rate, a token of func
+
+        Args:
+            func (str): function name of the call
+            rate (float): requests per second for func, 0 for no own limit
+        """
+        buckets = [self._global]
+        if func and rate > 0:
+            with self._lock:
+                if not func in self._buckets:
+                    self._buckets[func] = self._mkBucket(func, rate)
+            buckets.append(self._buckets[func])
+
+        waited = sum([b.acquire() for b in buckets if not b is None])
+        if waited > 0:
+            with self._lock:
+                self.waits += 1
+                self.waited += waited
+        return waited
+
+    def stats(self):
+        return {'waits': self.waits, 'waited': self.waited}
+
+
+_TWCC_LIMITER_ = None
+_TWCC_LIMITER_LOCK_ = threading.Lock()
+
+
+def limiter():
+    """ the process-wide RateLimiter, built from the environment on first use
+    """
+    global _TWCC_LIMITER_
+    with _TWCC_LIMITER_LOCK_:
+        if _TWCC_LIMITER_ is None:
+            _TWCC_LIMITER_ = RateLimiter()
+        return _TWCC_LIMITER_
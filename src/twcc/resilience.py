@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""retry, backoff and circuit breaker policy for TWCC API calls
+
+Every request gets a (connect, read) timeout for its verb. Connection
+errors, timeouts, 429 and 5xx are retried with exponential backoff and
+full jitter, honoring Retry-After. A non-idempotent verb (post, patch) is
+only retried when the gateway can not have acted on it: a connect error
+or a 429. A DELETE retried after the gateway may have acted on it takes a
+404 as done. A per-host circuit breaker counts one failure per failed
+call, fails fast with CircuitOpenError once the gateway keeps failing, and
+lets one trial call through after a cool down.
+
+Environment:
+    TWCC_HTTP_RETRIES: retries after the first attempt (default: 3)
+    TWCC_HTTP_BACKOFF: first backoff in seconds, doubled per retry (default: 0.5)
+    TWCC_HTTP_MAX_BACKOFF: longest backoff or Retry-After wait (default: 30)
+    TWCC_HTTP_TIMEOUT: "connect,read" seconds for every verb (default: 3.05,60)
+    TWCC_HTTP_TIMEOUT_<VERB>: same for one verb, ie. TWCC_HTTP_TIMEOUT_POST
+    TWCC_BREAKER_FAILURES: failures in a row which open a breaker (default: 5)
+    TWCC_BREAKER_RESET: seconds an open breaker fails fast (default: 30)
+"""
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+RETRY_STATUS = frozenset([429, 500, 502, 503, 504])
+IDEMPOTENT_VERBS = frozenset(['get', 'put', 'delete'])
+
+_log = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """ the breaker of a host is open, the call was not sent
+    """
+    pass
+
+
+def _timeout_env(name, default):
+    val = os.environ.get(name)
+    if not val:
+        return default
+    parts = [float(x) for x in val.split(',')]
+    return (parts[0], parts[-1])
+
+
+class RetryPolicy(object):
+
+    def __init__(self, retries=None, backoff=None, max_backoff=None, timeouts=None):
+        """ retry and timeout settings, None reads the environment
+
+        Args:
+            retries (int): retries after the first attempt
+            backoff (float): first backoff in seconds
+            max_backoff (float): longest wait between attempts
+            timeouts (dict): {verb: (connect, read)}, unlisted verbs use the default
+        """
+        self.retries = int(os.environ.get('TWCC_HTTP_RETRIES', 3)) if retries is None else retries
+        self.backoff = float(os.environ.get('TWCC_HTTP_BACKOFF', 0.5)) if backoff is None else backoff
+        self.max_backoff = float(os.environ.get('TWCC_HTTP_MAX_BACKOFF', 30)) if max_backoff is None else max_backoff
+        self.timeouts = {} if timeouts is None else dict(timeouts)
+        self.default_timeout = _timeout_env('TWCC_HTTP_TIMEOUT', (3.05, 60.))
+
+    def timeout(self, verb):
+        if verb in self.timeouts:
+            return self.timeouts[verb]
+        return _timeout_env('TWCC_HTTP_TIMEOUT_' + verb.upper(), self.default_timeout)
+
+    def retry_error(self, verb, error):
+        if not _is_network_error(error):
+            return False
+        if verb in IDEMPOTENT_VERBS:
+            return True
+        # only when the request can not have reached the gateway
+        return _is_connect_error(error)
+
+    def retry_status(self, verb, status_code):
+        if verb in IDEMPOTENT_VERBS:
+            return status_code in RETRY_STATUS
+        return status_code == 429
+
+    def delay(self, attempt, retry_after=None):
+        """ seconds to wait before retry number attempt (from 0)
+        """
+        wait = _parse_retry_after(retry_after)
+        if wait is None:
+            wait = random.uniform(0, self.backoff * (2 ** attempt))
+        return min(max(wait, 0.), self.max_backoff)
+
+
+def _is_network_error(error):
+    import requests
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def _is_connect_error(error):
+    import requests
+    from urllib3.exceptions import ConnectTimeoutError, MaxRetryError, NewConnectionError
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError):
+        return False
+    # a refused connection is a ConnectionError wrapping urllib3's MaxRetryError(reason=NewConnectionError)
+    cause = error.args[0] if len(error.args) > 0 else None
+    if isinstance(cause, MaxRetryError):
+        cause = cause.reason
+    return isinstance(cause, (NewConnectionError, ConnectTimeoutError))
+
+
+def _parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        when = email.utils.parsedate_tz(value)
+        if when is None:
+            return None
+        return email.utils.mktime_tz(when) - time.time()
+
+
+class CircuitBreaker(object):
+    """ closed -> open after max_failures in a row -> half_open after reset_timeout
+
+    In half_open a single trial call goes through, its success closes the
+    breaker and its failure opens it again.
+    """
+
+    def __init__(self, host, max_failures=None, reset_timeout=None):
+        self.host = host
+        self.max_failures = int(os.environ.get('TWCC_BREAKER_FAILURES', 5)) if max_failures is None else max_failures
+        self.reset_timeout = float(os.environ.get('TWCC_BREAKER_RESET', 30)) if reset_timeout is None else reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'open' and time.time() - self._opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                self._trial = False
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def release(self):
+        """ the call said nothing about the host, let another trial through
+        """
+        with self._lock:
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.max_failures:
+                if not self.state == 'open':
+                    self.opened += 1
+                    _log.warning("circuit breaker for %s is open", self.host)
+                self.state = 'open'
+                self._opened_at = time.time()
+
+
+_BREAKERS_ = {}
+_LOCK_ = threading.Lock()
+_METRICS_ = {'calls': 0, 'retries': 0, 'gave_up': 0, 'fast_fails': 0}
+_POLICY_ = None
+
+
+def default_policy():
+    """ the RetryPolicy of the environment, read once per process
+    """
+    global _POLICY_
+    with _LOCK_:
+        if _POLICY_ is None:
+            _POLICY_ = RetryPolicy()
+        return _POLICY_
+
+
+def breaker(host):
+    """ the process-wide CircuitBreaker of a host
+    """
+    with _LOCK_:
+        if not host in _BREAKERS_:
+            _BREAKERS_[host] = CircuitBreaker(host)
+        return _BREAKERS_[host]
+
+
+def _count(name):
+    with _LOCK_:
+        _METRICS_[name] += 1
+
+
+def stats():
+    """ retry counters and breaker state per host of this process
+    """
+    with _LOCK_:
+        res = dict(_METRICS_)
+        res['breakers'] = dict([(host, {'state': b.state, 'failures': b.failures, 'opened': b.opened})
+                                for (host, b) in _BREAKERS_.items()])
+    return res
+
+
+def call(sess, verb, url, policy=None, acquire=None, **kwargs):
+    """ send one API request under the retry policy and the breaker of its host
+
+    Args:
+        sess (requests.Session): session to send with
+        verb (str): get, post, put, patch or delete
+        url (str): full url
+        policy (RetryPolicy): None for default_policy()
+        acquire (callable): called before every attempt once the breaker let the call
+            through, ie. to take a rate limit token
+        kwargs: passed to sess.request, ie. headers, data
+
+    Returns:
+        the last requests.Response, a 429/5xx is returned once retries are used up
+
+    Raises:
+        CircuitOpenError: the gateway is failing, the call was not sent
+        requests.RequestException: from the last attempt
+    """
+    if policy is None:
+        policy = default_policy()
+    brk = breaker(urlparse(url).netloc)
+    _count('calls')
+
+    # the breaker is asked once, its retries belong to the same call
+    if not brk.allow():
+        _count('fast_fails')
+        raise CircuitOpenError("{0} is failing, retry in {1:.0f} sec".format(
+            brk.host, brk.reset_timeout))
+
+    attempt = 0
+    # an earlier attempt may have been carried out by the gateway
+    maybe_done = False
+    while True:
+        if not acquire is None:
+            acquire()
+
+        retry_after = None
+        try:
+            r = sess.request(verb.upper(), url, timeout=policy.timeout(verb), **kwargs)
+        except Exception as e:
+            if attempt >= policy.retries or not policy.retry_error(verb, e):
+                if _is_network_error(e):
+                    brk.failure()
+                else:
+                    brk.release()
+                if attempt > 0:
+                    _count('gave_up')
+                raise
+            maybe_done = maybe_done or not _is_connect_error(e)
+            reason = type(e).__name__
+        else:
+            if verb == 'delete' and maybe_done and r.status_code == 404:
+                _log.info("%s %s -> 404 after a retry, taken as deleted", verb.upper(), url)
+                r.status_code = 204
+            if not r.status_code in RETRY_STATUS:
+                brk.success()
+                return r
+            if attempt >= policy.retries or not policy.retry_status(verb, r.status_code):
+                if r.status_code >= 500:
+                    brk.failure()
+                else:
+                    # a 429 is a gateway at work
+                    brk.success()
+                if attempt > 0:
+                    _count('gave_up')
+                return r
+            maybe_done = maybe_done or r.status_code >= 500
+            reason = r.status_code
+            retry_after = r.headers.get('Retry-After')
+
+        wait = policy.delay(attempt, retry_after)
+        _log.info("retry %d/%d in %.2f sec: %s %s -> %s",
+                  attempt + 1, policy.retries, wait, verb.upper(), url, reason)
+        _count('retries')
+        time.sleep(wait)
+        attempt += 1
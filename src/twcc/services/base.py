@@ -108,8 +108,8 @@ class projects(GenericService):
 
 
     def getS3ProjId(self, proj_code):
-        projs = self.list()
-        for proj in projs:
+        # stop at the first match, later pages are never fetched
+        for proj in self.iter_list():
             if proj['name'] == proj_code:
                 return proj['id']
 
@@ -1,12 +1,30 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
+import json
 from twcc.services.generic import GenericService
 from twcc.services.solutions import solutions
 from twcc.services.base import projects
-from twcc.util import pp, isNone, table_layout
+from twcc.cache import DiskCache
+from twcc.util import pp, isNone, table_layout, parallel_map
+
+# a site in one of these will never become Ready
+SITE_FAILED_STATUS = ('Error', 'Deleting')
 
 chkPortPair = lambda x: True if type(x)==type({}) and len(set(['exposed', 'inner']).intersection(set(x.keys())) ) == 2 else False
 
+def _errMsg(content):
+    """ 'detail' or 'message' of an error response, else its body
+    """
+    try:
+        res = json.loads(content.decode('utf-8'))
+    except ValueError:
+        return content.decode('utf-8', 'replace')[:200]
+    if isinstance(res, dict):
+        for k in ('detail', 'message'):
+            if k in res:
+                return res[k]
+    return res
+
 class sites(GenericService):
     # use default key_tag
     #def __init__(self, api_key_tag, debug=False):
@@ -142,6 +160,12 @@ class sites(GenericService):
             self.ext_get = {'project': self._project_id}
         return self._do_api()
 
+    def iter_list(self, isAll=False, prefetch=False):
+        ext_get = {'project': self._project_id}
+        if isAll:
+            ext_get['all_users'] = 1
+        return GenericService.iter_list(self, ext_get=ext_get, prefetch=prefetch)
+
 
     def create(self, name, sol_id, extra_prop):
 
@@ -157,6 +181,21 @@ class sites(GenericService):
                 "solution": sol_id}
         return self._do_api()
 
+    def create_many(self, specs, max_workers=8):
+        """ create sites at the same time on a thread pool
+
+        Args:
+            specs (list): dicts with 'name', 'sol_id' and 'extra_prop'
+            max_workers (int): creates in flight
+
+        Returns:
+            list of (spec, result, error) in the order of specs
+        """
+        # create() sets header_extra on its ServiceOperation, use one sites for each create
+        def _create(spec):
+            return sites(debug=self._debug_).create(spec['name'], spec['sol_id'], dict(spec['extra_prop']))
+        return list(parallel_map(_create, specs, max_workers=max_workers))
+
     def update(self, data_dic):
         self.http_verb = 'put'
         self.res_type = 'txt'
@@ -170,11 +209,27 @@ class sites(GenericService):
         self.url_dic = {"sites":site_id}
         return self._do_api()
 
+    def delete_many(self, site_ids, max_workers=8):
+        """ delete sites at the same time on a thread pool
+
+        Args:
+            site_ids (list): site ids to delete
+            max_workers (int): deletes in flight
+
+        Returns:
+            list of (site_id, result, error) in the order of site_ids
+        """
+        # a sites object keeps per-call state, use one for each delete
+        def _delete(site_id):
+            a = sites(debug=self._debug_)
+            res = a.delete(site_id)
+            if a.twcc.status_code >= 400:
+                raise ValueError("HTTP {0}: {1}".format(a.twcc.status_code, _errMsg(res)))
+            return res
+        return list(parallel_map(_delete, site_ids, max_workers=max_workers))
+
     def list_solution(self, sol_id, isShow=True):
-        t_sol = None
-        if sol_id in self._cache_sol_:
-            t_sol = self._cache_sol_
-        else:
+        if not sol_id in self._cache_sol_:
             self._do_list_solution(sol_id)
 
         ans = self._cache_sol_[sol_id]
@@ -185,11 +240,17 @@ class sites(GenericService):
             return ans
 
     def _do_list_solution(self, sol_id):
-        self.proj = projects(self.twcc._debug)
-        self.proj._csite_ = self._csite_
-
-        ans = self.proj.getProjectSolution(self._project_id, sol_id)
-        table_info = ans['site_extra_prop']
+        # images/buckets of a solution rarely change, keep them on disk
+        cache = DiskCache('site_extra_prop')
+        key = [self._csite_, self._project_id, sol_id]
+        table_info = cache.get(key)
+        if table_info is None:
+            self.proj = projects(self.twcc._debug)
+            self.proj._csite_ = self._csite_
+
+            ans = self.proj.getProjectSolution(self._project_id, sol_id)
+            table_info = ans['site_extra_prop']
+            cache.set(key, table_info)
         self._cache_sol_[ sol_id ] = table_info
 
     def getConnInfo(self, site_id):
@@ -205,6 +266,55 @@ class sites(GenericService):
         site_info = self.queryById(site_id)
         return site_info['status'] == "Ready"
 
+    def waitReady(self, site_ids, timeout=1800, interval=2, max_interval=30,
+                  factor=1.5, callback=None):
+        """ wait for many sites with one sites.list() per tick
+
+        Ticks back off exponentially from interval to max_interval with
+        +-20% jitter, until every site is Ready, failed or timeout is reached.
+        A site in SITE_FAILED_STATUS, or missing from the list, is failed
+        and no longer waited for.
+
+        Args:
+            site_ids (list): site ids to wait for
+            timeout (float): overall deadline in seconds
+            interval (float): first wait between ticks in seconds
+            max_interval (float): longest wait between ticks in seconds
+            factor (float): backoff multiplier for each tick
+            callback (function): called as callback(site_id, seconds, status) when a site
+                is Ready or failed, status is None for a site missing from the list
+
+        Returns:
+            dict of {site_id: seconds to Ready}, None for sites not Ready before timeout
+        """
+        import random
+        import time
+
+        start = time.time()
+        waiting = dict([(str(x), x) for x in site_ids])
+        ready = dict([(x, None) for x in site_ids])
+        delay = interval
+        while True:
+            site_infos = self.list()
+            # an error comes back as a dict, try again on next tick
+            if type(site_infos) == type([]):
+                status = dict([(str(info['id']), info['status']) for info in site_infos])
+                for sid in list(waiting):
+                    if status.get(sid) == "Ready":
+                        ready[waiting[sid]] = time.time() - start
+                    elif sid in status and not status[sid] in SITE_FAILED_STATUS:
+                        continue
+                    if not isNone(callback):
+                        callback(waiting[sid], time.time() - start, status.get(sid))
+                    del waiting[sid]
+
+            remain = timeout - (time.time() - start)
+            if len(waiting) == 0 or remain <= 0:
+                return ready
+
+            time.sleep(min(remain, min(delay, max_interval) * random.uniform(0.8, 1.2)))
+            delay *= factor
+
     def getDetail(self, site_id):
         self.url_dic = {"sites":site_id, 'container':""}
         self.http_verb = 'get'
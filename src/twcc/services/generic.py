@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 import os
-import yaml
 from twcc.util import pp, isNone
 from twcc.clidriver import ServiceOperation
+try:
+    from urllib.parse import urlparse, parse_qsl
+except ImportError:
+    from urlparse import urlparse, parse_qsl
 
 # change to new-style-class https://goo.gl/AYgxqp
 class GenericService(object):
@@ -92,6 +95,86 @@ class GenericService(object):
         self.res_type = 'json'
         return self._do_api()
 
+    def iter_list(self, ext_get=None, prefetch=False):
+        """ yield the items of list() one by one, page after page
+
+        A page number is sent when the function has a 'pagination' entry in
+        the resources YAML, ie.
+            pagination:
+                param: "page"            # pages from 1 until an empty or short page
+                size_param: "page_size"  # optional
+                size: 100                # optional
+        A {'results': [...], 'next': url} page is always followed by its next
+        link, with the query of the link merged into ext_get. A follow-up page
+        answered with 404 or {'detail': ...}, as DRF does for the page after an
+        exactly full last page, ends the list. Stop iterating to skip the
+        remaining pages.
+
+        Args:
+            ext_get (dict): get parameters, self.ext_get if None
+            prefetch (bool): fetch the next page in a background thread while items are used
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        pg = self.twcc.routes[self._func_].pagination or {}
+        query = dict((self.ext_get if isNone(ext_get) else ext_get) or {})
+        if 'param' in pg:
+            query[pg['param']] = pg.get('start', 1)
+            if 'size_param' in pg:
+                query[pg['size_param']] = pg.get('size', 100)
+        (csite, key_tag, func, url_dic) = (self._csite_, self._api_key_, self._func_, self.url_dic)
+
+        def _fetch(q):
+            # no per-call state on self, this may run in the prefetch thread
+            page = self.twcc.doAPI(
+                site_sn=csite, key_tag=key_tag, func=func,
+                url_dict=url_dic, url_ext_get=q if len(q) > 0 else None,
+                http='get', res_type='json')
+            return (self.twcc.status_code, page)
+
+        def _is_end(status, page):
+            return status == 404 or (isinstance(page, dict) and 'detail' in page
+                                     and not pg.get('results', 'results') in page)
+
+        def _items(page):
+            if isinstance(page, list):
+                return page
+            if isinstance(page, dict) and isinstance(page.get(pg.get('results', 'results')), list):
+                return page[pg.get('results', 'results')]
+            raise ValueError("Can not list {0}: {1}".format(func, page))
+
+        def _next_query(q, page):
+            if isinstance(page, dict) and page.get(pg.get('next', 'next')):
+                nq = dict(q)
+                nq.update(parse_qsl(urlparse(page[pg.get('next', 'next')]).query))
+                return nq
+            items = _items(page)
+            if 'param' in pg and len(items) > 0 and len(items) >= pg.get('size', 1):
+                nq = dict(q)
+                nq[pg['param']] = int(nq[pg['param']]) + 1
+                return nq
+            return None
+
+        pool = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            (q, page) = (query, _fetch(query)[1])
+            while True:
+                nq = _next_query(q, page)
+                fut = pool.submit(_fetch, nq) if not isNone(pool) and not isNone(nq) else None
+                for item in _items(page):
+                    yield item
+                if isNone(nq):
+                    return
+                (q, prev, (status, page)) = (nq, page, fut.result() if not isNone(fut) else _fetch(nq))
+                if _is_end(status, page):
+                    return
+                if 'param' in pg and page == prev:
+                    # the api ignores the page number and sent the same page again
+                    return
+        finally:
+            if not isNone(pool):
+                pool.shutdown(wait=False)
+
     def queryById(self, mid):
         self.url_dic = { self.__class__.__name__ : mid }
         self.http_verb = 'get'
@@ -1,14 +1,143 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
+import calendar
+import hashlib
 import os 
+import threading
+import time
 import boto3
-import click
+try:
+    from inspect import getfullargspec as getargspec
+except ImportError:
+    from inspect import getargspec
 
-from botocore.exceptions import ClientError 
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.client import Config
+from botocore.exceptions import BotoCoreError, ClientError 
+from twcc.cache import DiskCache
 from twcc.clidriver import ServiceOperation
 from termcolor import colored
-from terminaltables import AsciiTable
-from tqdm import tqdm
+from twcc.util import isNone, parallel_map
+
+MB = 1024 * 1024
+# local hashes in a sync manifest are keyed by size and mtime, so they stay valid long
+MANIFEST_TTL = 30 * 24 * 3600
+# state of unfinished resumable transfers, S3 usually expires incomplete uploads in days
+RESUME_TTL = 7 * 24 * 3600
+# most parts a multipart upload takes
+MAX_PARTS = 10000
+# largest object copy_object takes, and largest part of upload_part_copy
+COPY_LIMIT = 5 * 1024 * MB
+# seconds between saves of the finished parts of a resumable download
+RESUME_SAVE_EVERY = 5
+# suffix of the file a resumable download writes to until it is complete
+PART_SUFFIX = ".twccpart"
+# most keys a DeleteObjects request takes
+DELETE_BATCH = 1000
+# errors worth another try, upload_file wraps ClientError into S3UploadFailedError
+TRANSFER_ERRORS = (ClientError, S3UploadFailedError, BotoCoreError)
+# older boto3, like the pinned 1.9.63, has no bandwidth limit in TransferConfig
+HAS_MAX_BANDWIDTH = 'max_bandwidth' in getargspec(TransferConfig.__init__).args
+
+
+def file_etag(file_name, chunksize=None):
+    """ S3 style ETag of a local file
+
+        :param file_name : Local file path
+        :param chunksize : Part size of a multipart upload, None for a single part
+        :return          : md5 hex, or md5 of the part md5s with '-N' for multipart
+    """
+    with open(file_name, 'rb') as fp:
+        if chunksize is None:
+            md5 = hashlib.md5()
+            for buf in iter(lambda: fp.read(MB), b''):
+                md5.update(buf)
+            return md5.hexdigest()
+        digests = [hashlib.md5(buf).digest() for buf in iter(lambda: fp.read(chunksize), b'')]
+    return "{}-{}".format(hashlib.md5(b"".join(digests)).hexdigest(), len(digests))
+
+
+# boto3 clients are thread safe and slow to build, one per endpoint and credentials
+_TWCC_S3_CLIENTS_ = {}
+_TWCC_S3_LOCK_ = threading.Lock()
+
+
+def s3_client(access_key, secret_key, endpoint_url, max_pool=None):
+    """ Get the process-wide boto3 S3 client for an endpoint and credentials
+
+        The client is built on first use and shared by every S3 object and
+        thread, so the botocore model is loaded once per process.
+
+        :param access_key   : S3 access key
+        :param secret_key   : S3 secret key
+        :param endpoint_url : S3 endpoint, ie. https://s3.twcc.ai
+        :param max_pool     : Connections kept by the client, env TWCC_S3_MAX_POOL (default: 50)
+        :return             : boto3 S3 client
+    """
+    if isNone(max_pool):
+        max_pool = int(os.environ.get('TWCC_S3_MAX_POOL', 50))
+    cache_key = (endpoint_url, access_key,
+                 hashlib.sha1(secret_key.encode('utf-8')).hexdigest(), max_pool)
+    with _TWCC_S3_LOCK_:
+        if not cache_key in _TWCC_S3_CLIENTS_:
+            # a boto3 Session is not thread safe, only build clients under the lock
+            session = boto3.session.Session()
+            _TWCC_S3_CLIENTS_[cache_key] = session.client(
+                service_name='s3',
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_key,
+                endpoint_url=endpoint_url,
+                verify=False,
+                config=Config(max_pool_connections=max_pool))
+        return _TWCC_S3_CLIENTS_[cache_key]
+
+
+def _read_full(fp, size):
+    """ read size bytes, pipes may return less on a single read
+    """
+    bufs = []
+    while size > 0:
+        buf = fp.read(size)
+        if not buf:
+            break
+        bufs.append(buf)
+        size -= len(buf)
+    return b"".join(bufs)
+
+
+class TqdmProgress(object):
+    """ boto3 transfer callback, shows bytes and bytes/sec on a tqdm bar
+    """
+    def __init__(self, total=None, desc=None):
+        from tqdm import tqdm
+        self._lock = threading.Lock()
+        self.pbar = tqdm(total=total, desc=desc, unit='B', unit_scale=True)
+
+    def __call__(self, bytes_amount):
+        # boto3 calls back from its transfer threads
+        with self._lock:
+            self.pbar.update(bytes_amount)
+
+    def attempt(self, func):
+        """ run func(callback) once, the bytes it reported are taken back if it raises,
+            so a retried file or part is not counted twice
+        """
+        done = [0]
+
+        def _callback(bytes_amount):
+            with self._lock:
+                done[0] += bytes_amount
+                self.pbar.update(bytes_amount)
+        try:
+            return func(_callback)
+        except Exception:
+            with self._lock:
+                self.pbar.update(-done[0])
+            raise
+
+    def close(self):
+        self.pbar.close()
 
 
 class S3():
@@ -21,6 +150,7 @@ class S3():
         self.new_files = []
         self.new_bucket = []
         self.twcc = ServiceOperation()
+        self.transfer_config = TransferConfig()
         self.access_key = self.twcc.def_s3_access_key
         self.secret_key = self.twcc.def_s3_secret_key
 
@@ -29,12 +159,33 @@ class S3():
         if not self.access_key or not self.secret_key:
             raise Exception("No key entered by user")
 
-        session = boto3.session.Session()
-        self.s3_cli = session.client(service_name = self.service_name,
-                                     aws_access_key_id = self.access_key,
-                                     aws_secret_access_key = self.secret_key,
-                                     endpoint_url = 'https://' + self.endpoint_url, 
-                                     verify=False)
+        self.s3_cli = s3_client(self.access_key, self.secret_key,
+                                'https://' + self.endpoint_url)
+
+    def set_transfer_config(self, multipart_threshold=None, multipart_chunksize=None,
+                            max_concurrency=None, max_bandwidth=None):
+        """ Tune boto3 TransferConfig for upload/download, None keeps boto3 default
+
+            :param multipart_threshold : Size in MB to switch to multipart transfer
+            :param multipart_chunksize : Size in MB of each part
+            :param max_concurrency     : Number of threads for one file
+            :param max_bandwidth       : MB/s limit, raises ValueError if boto3 can not limit bandwidth
+            :return                    : The TransferConfig in use
+        """
+        conf = {}
+        if not multipart_threshold is None:
+            conf['multipart_threshold'] = int(multipart_threshold * MB)
+        if not multipart_chunksize is None:
+            conf['multipart_chunksize'] = int(multipart_chunksize * MB)
+        if not max_concurrency is None:
+            conf['max_concurrency'] = max_concurrency
+        if not max_bandwidth is None:
+            if not HAS_MAX_BANDWIDTH:
+                raise ValueError("boto3 {0} can not limit bandwidth, upgrade boto3 to use max_bandwidth".format(
+                    boto3.__version__))
+            conf['max_bandwidth'] = int(max_bandwidth * MB)
+        self.transfer_config = TransferConfig(**conf)
+        return self.transfer_config
 
     def list_bucket(self):
         """ Listing all the bucket for S3 directory
@@ -48,26 +199,45 @@ class S3():
         total_data.insert(0,head_data)
         return total_data
 
-    def list_object(self,bucket_name):
+    def list_object(self,bucket_name,prefix=''):
         """ Listing all the file insife of S3 bucket.
 
             :param bucket_name : Unique string name
+            :param prefix      : Only list keys starting with prefix
             :return            : List all object inside of S3 bucket. 
         """
-        res = self.s3_cli.list_objects(Bucket=bucket_name)
-        tmp = []
-        if 'Contents' in res.keys():
-            head_data = [bucket_name for bucket_name in res['Contents'][0].keys() if bucket_name not in ('ETag','Owner')]
-            for num in range(len(res['Contents'])):
-                tmp_list = [res['Contents'][num][x] if x != 'LastModified' else str(res['Contents'][num][x]).split('.')[0] for x in head_data]
-                tmp.append(tmp_list)
+        head_data = ['Key', 'LastModified', 'Size', 'StorageClass']
+        tmp = [self.object_row(obj, head_data) for obj in self.iter_objects(bucket_name, prefix=prefix)]
+        if len(tmp) > 0:
             tmp.insert(0,head_data)       
             return tmp
         else:
             tmp = [['Nothing inside the bucket']]
             return tmp
-        
-    def upload_bucket(self,file_name=None,bucket_name=None,key=None,path=None,r=False):
+
+    @staticmethod
+    def object_row(obj, head_data):
+        return [obj.get(x) if x != 'LastModified' else str(obj[x]).split('.')[0] for x in head_data]
+
+    def iter_objects(self,bucket_name,prefix='',delimiter='',with_prefixes=False):
+        """ Yield objects of a bucket page by page with list_objects_v2,
+            memory use does not grow with the size of the bucket.
+
+            :param bucket_name   : Unique string name
+            :param prefix        : Only list keys starting with prefix
+            :param delimiter     : Group keys sharing a prefix up to delimiter
+            :param with_prefixes : Also yield those groups as {'Prefix': ...}
+            :return              : Generator of object dicts, ie. {'Key', 'Size', 'ETag', 'LastModified', ...}
+        """
+        paginator = self.s3_cli.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name,Prefix=prefix,Delimiter=delimiter):
+            for obj in page.get('Contents', []):
+                yield obj
+            if with_prefixes:
+                for common_prefix in page.get('CommonPrefixes', []):
+                    yield common_prefix
+
+    def upload_bucket(self,file_name=None,bucket_name=None,key=None,path=None,r=False,max_workers=8,retries=2,resume=False):
         """ Upload to S3
 
             :param file_name         : The name of the upload file 
@@ -75,32 +245,141 @@ class S3():
             :param bucket_name       : The bucket name
             :param key               : The file name shows inside the bucket
             :param r                 : Setting for recursive
+            :param max_workers       : Files uploaded at the same time when r is True
+            :param retries           : Retries for each failed file when r is True
+            :param resume            : Upload large files with upload_resumable
             :return                  : True if success upload file to S3 bucket
         """
         if r == True:
             if os.path.isdir(path):
-                on_local_path_len = len("/".join(path.split('/')[:-1])) # Get the len of the local path.
-                for root,dirs,files in tqdm(os.walk(path)): # Loop through all the files in the local.
-                    for f_name in files:
-                        local_file_path = os.path.join(root,f_name) # Get the local file path. 
-                        remote_file_path = local_file_path[on_local_path_len + 1:] # Create the key name on S3.
-                        try:
-                            self.s3_cli.upload_file(local_file_path,bucket_name,remote_file_path)
-                        except ClientError as e:
-                            print(e)
-                            return False
+                res = self.upload_dir(path, bucket_name, max_workers=max_workers, retries=retries)
+                return len(res['failed']) == 0
             else:
                 print("No such path")
+        elif resume and os.path.getsize(file_name) >= self.transfer_config.multipart_threshold:
+            try:
+                self.upload_resumable(file_name,bucket_name,key,retries=retries)
+                print("Successfully upload file : ",key)
+            except TRANSFER_ERRORS as e:
+                print(e)
+                return False
+            return True
         else:
+            progress = TqdmProgress(total=os.path.getsize(file_name), desc=key)
             try:
-                response = self.s3_cli.upload_file(file_name,bucket_name,key)
+                response = self.s3_cli.upload_file(file_name,bucket_name,key,
+                                                   Config=self.transfer_config,Callback=progress)
+                progress.close()
                 print("Successfully upload file : ",key)
-            except ClientError as e:
+            except TRANSFER_ERRORS as e:
+                progress.close()
                 print(e)
                 return False
             return True
 
-    def download_bucket(self,bucket_name=None,key=None,file_name=None,path=None,r=False):
+    def upload_dir(self,path,bucket_name,max_workers=8,retries=2):
+        """ Upload a directory tree with a pool of uploaders sharing this client
+
+            Files are streamed from os.walk into the pool, a failed file is
+            retried and then reported, it never stops the other uploads.
+
+            :param path              : The local directory
+            :param bucket_name       : The bucket name
+            :param max_workers       : Files uploaded at the same time
+            :param retries           : Retries for each failed file
+            :return                  : dict of files, bytes, seconds and failed [(local path, key, error)]
+        """
+        on_local_path_len = len("/".join(path.split('/')[:-1])) # Get the len of the local path.
+
+        def _walk():
+            for root,dirs,files in os.walk(path): # Loop through all the files in the local.
+                for f_name in files:
+                    local_file_path = os.path.join(root,f_name) # Get the local file path.
+                    # no stat here, a file which is gone or broken fails in its worker
+                    yield (local_file_path, local_file_path[on_local_path_len + 1:]) # Create the key name on S3.
+
+        res = self.transfer_files("upload", bucket_name, _walk(), max_workers=max_workers, retries=retries)
+        print(self.transfer_summary("upload", res))
+        return res
+
+    def transfer_files(self,action,bucket_name,jobs,max_workers=8,retries=2,skip=None):
+        """ Run uploads or downloads on a pool of workers sharing this client
+
+            :param action            : "upload" or "download"
+            :param bucket_name       : The bucket name
+            :param jobs              : Iterable of (local path, key, size, ...), a size left out or None
+                                       for uploads stats the file in the worker
+            :param max_workers       : Files transferred at the same time
+            :param retries           : Retries for each failed file
+            :param skip              : skip(job) is True for a job to leave alone, run in the worker
+                                       as it may hash the file
+            :return                  : dict of files, bytes, skipped, seconds and failed [(local path, key, error)]
+        """
+        func = self._put_file if action == "upload" else self._get_file
+        progress = TqdmProgress(desc=bucket_name)
+
+        def _transfer(job):
+            if not isNone(skip) and skip(job):
+                return None
+            job = (job[0], job[1], self._job_size(job))
+            self._retry(retries, lambda: progress.attempt(lambda callback: func(bucket_name, job, callback)))
+            return job[2]
+
+        start_time = time.time()
+        res = {'files': 0, 'bytes': 0, 'skipped': 0, 'failed': []}
+        try:
+            for (job, done, err) in parallel_map(
+                    _transfer, jobs, max_workers=max_workers, ordered=False):
+                if isNone(err) and isNone(done):
+                    res['skipped'] += 1
+                elif isNone(err):
+                    res['files'] += 1
+                    res['bytes'] += done
+                else:
+                    res['failed'].append((job[0], job[1], err))
+        finally:
+            progress.close()
+        res['seconds'] = time.time() - start_time
+
+        for (local_file_path, key, err) in res['failed']:
+            print("ERROR during {} {} : {}".format(action, local_file_path, err))
+        return res
+
+    @staticmethod
+    def _job_size(job):
+        return job[2] if len(job) > 2 and not isNone(job[2]) else os.path.getsize(job[0])
+
+    def _put_file(self,bucket_name,job,progress):
+        (local_file_path, key, size) = job
+        # small files skip the TransferManager that upload_file builds per call
+        if size < self.transfer_config.multipart_threshold:
+            with open(local_file_path, 'rb') as fp:
+                self.s3_cli.put_object(Bucket=bucket_name,Key=key,Body=fp)
+            progress(size)
+        else:
+            self.s3_cli.upload_file(local_file_path,bucket_name,key,
+                                    Config=self.transfer_config,Callback=progress)
+
+    def _get_file(self,bucket_name,job,progress):
+        (local_file_path, key, size) = job
+        if size < self.transfer_config.multipart_threshold:
+            body = self.s3_cli.get_object(Bucket=bucket_name,Key=key)['Body']
+            with open(local_file_path, 'wb') as fp:
+                for buf in iter(lambda: body.read(MB), b''):
+                    fp.write(buf)
+                    progress(len(buf))
+        else:
+            self.s3_cli.download_file(bucket_name,key,local_file_path,
+                                      Config=self.transfer_config,Callback=progress)
+
+    @staticmethod
+    def transfer_summary(action, res):
+        sec = max(res['seconds'], 1e-6)
+        return "{0}: {1} files, {2:.1f} MB in {3:.1f} sec ({4:.1f} files/s, {5:.2f} MB/s), {6} failed".format(
+            action, res['files'], float(res['bytes']) / MB, res['seconds'],
+            res['files'] / sec, float(res['bytes']) / MB / sec, len(res['failed']))
+
+    def download_bucket(self,bucket_name=None,key=None,file_name=None,path=None,r=False,max_workers=8,retries=2,prefix='',resume=False):
         """ Download from S3
 
             :param bucket_name       : The bucket name
@@ -108,22 +387,17 @@ class S3():
             :param path              : The path for the files, r must set ot True
             :param file_name         : The name of the download file
             :param r                 : Setting for recursive
+            :param max_workers       : Files downloaded at the same time when r is True
+            :param retries           : Retries for each failed file when r is True
+            :param prefix            : Only download keys starting with prefix when r is True
+            :param resume            : Download large files with download_resumable
             :return            : True if success upload file to S3 bucket
         """
         if r == True:
             # checking for download path exists
             if os.path.isdir(path):
-                # get the list of objects inside the bucket
-                a = self.list_object(bucket_name)[1:]
-                # loop through all the objects
-                for i in a:
-                    ff_name = os.path.join(path+'/', i[2])
-                    check_path = "/".join(ff_name.split('/')[:-1])
-                    # check if the download folder exists
-                    if not os.path.isdir(check_path):
-                        os.mkdir(check_path)
-                    # download to the correct path
-                    self.s3_cli.download_file(bucket_name,i[2],ff_name)
+                res = self.download_dir(bucket_name, path, prefix=prefix, max_workers=max_workers, retries=retries)
+                return len(res['failed']) == 0
             else:
                 print("No such path")
         else:
@@ -132,16 +406,488 @@ class S3():
                     check_path = "/".join(file_name.split('/')[:-1])
 
                 print(check_path)
-                if not os.path.isdir(check_path):
-                    os.mkdir(check_path)
+                if check_path and not os.path.isdir(check_path):
+                    os.makedirs(check_path)
 
-                response = self.s3_cli.download_file(bucket_name,key,file_name)
+                size = self.s3_cli.head_object(Bucket=bucket_name,Key=key)['ContentLength']
+                if resume and size >= self.transfer_config.multipart_threshold:
+                    self.download_resumable(bucket_name,key,file_name,retries=retries)
+                else:
+                    progress = TqdmProgress(total=size, desc=key)
+                    try:
+                        response = self.s3_cli.download_file(bucket_name,key,file_name,
+                                                             Config=self.transfer_config,Callback=progress)
+                    finally:
+                        progress.close()
                 print("Successfully download file : ",file_name)
-            except ClientError as e:
+            except TRANSFER_ERRORS as e:
                 print("ERROR during download : ",e)
                 return False
             return True
 
+    def upload_resumable(self,file_name,bucket_name,key,retries=2):
+        """ Multipart upload which continues an interrupted upload of the same file
+
+            The upload id and part size are kept in $TWCC_DATA_PATH/cache/s3_resume
+            until the upload completes. A rerun lists the parts already on S3 and
+            only sends the missing ones, as long as the local file keeps its size
+            and mtime.
+
+            :param file_name   : The name of the upload file
+            :param bucket_name : The bucket name
+            :param key         : The file name shows inside the bucket
+            :param retries     : Retries for each failed part
+        """
+        st = os.stat(file_name)
+        states = DiskCache('s3_resume', ttl=RESUME_TTL)
+        state_key = ['upload', bucket_name, key, os.path.abspath(file_name)]
+        state = states.get(state_key)
+
+        done = {}
+        if not isNone(state) and [state['size'], state['mtime']] == [st.st_size, st.st_mtime]:
+            try:
+                done = self._uploaded_parts(bucket_name, key, state)
+            except ClientError as e:
+                # NoSuchUpload, the upload was aborted or expired
+                state = None
+        else:
+            state = None
+
+        if isNone(state):
+            part_size = max(self.transfer_config.multipart_chunksize, -(-st.st_size // MAX_PARTS))
+            upload_id = self.s3_cli.create_multipart_upload(Bucket=bucket_name,Key=key)['UploadId']
+            state = {'upload_id': upload_id, 'part_size': part_size,
+                     'size': st.st_size, 'mtime': st.st_mtime}
+            states.set(state_key, state)
+
+        part_size = state['part_size']
+        part_len = lambda num: min(part_size, st.st_size - (num - 1) * part_size)
+        num_parts = max(1, -(-st.st_size // part_size))
+
+        progress = TqdmProgress(total=st.st_size, desc=key)
+        progress(sum([part_len(num) for num in done]))
+
+        def _upload_part(num):
+            with open(file_name, 'rb') as fp:
+                fp.seek((num - 1) * part_size)
+                body = fp.read(part_len(num))
+            etag = self._retry(retries, lambda: self.s3_cli.upload_part(
+                Bucket=bucket_name, Key=key, UploadId=state['upload_id'],
+                PartNumber=num, Body=body)['ETag'])
+            progress(len(body))
+            return etag
+
+        errors = []
+        try:
+            for (num, etag, err) in parallel_map(
+                    _upload_part, [num for num in range(1, num_parts + 1) if not num in done],
+                    max_workers=self.transfer_config.max_concurrency, ordered=False):
+                if isNone(err):
+                    # list_parts tells a rerun what is done, nothing to save per part
+                    done[num] = etag
+                else:
+                    errors.append(err)
+        finally:
+            progress.close()
+        if len(errors) > 0:
+            print("Upload of {} stopped at {}/{} parts, run it again to resume".format(
+                file_name, len(done), num_parts))
+            raise errors[0]
+
+        self.s3_cli.complete_multipart_upload(
+            Bucket=bucket_name, Key=key, UploadId=state['upload_id'],
+            MultipartUpload={'Parts': [{'PartNumber': num, 'ETag': done[num]} for num in sorted(done)]})
+        states.invalidate(state_key)
+
+    def _uploaded_parts(self,bucket_name,key,state):
+        """ {part number: ETag} of the parts S3 holds for a resumed upload
+
+            Only parts of the expected length count, the last one may be short.
+        """
+        part_size = state['part_size']
+        last_num = max(1, -(-state['size'] // part_size))
+        parts = {}
+        paginator = self.s3_cli.get_paginator('list_parts')
+        for page in paginator.paginate(Bucket=bucket_name,Key=key,UploadId=state['upload_id']):
+            for part in page.get('Parts', []):
+                num = part['PartNumber']
+                if part['Size'] == min(part_size, state['size'] - (num - 1) * part_size) and num <= last_num:
+                    parts[num] = part['ETag']
+        return parts
+
+    def download_resumable(self,bucket_name,key,file_name,retries=2):
+        """ Download with ranged GETs into file_name + PART_SUFFIX, continuing an interrupted download
+
+            Finished parts are saved to $TWCC_DATA_PATH/cache/s3_resume every
+            RESUME_SAVE_EVERY seconds and when the download stops, a rerun only
+            fetches the missing ranges as long as the object ETag is the same,
+            the partial file is renamed to file_name once complete. Parts are
+            multipart_chunksize, larger for objects of more than MAX_PARTS parts.
+
+            :param bucket_name : The bucket name
+            :param key         : The file name shows inside the bucket
+            :param file_name   : The name of the download file
+            :param retries     : Retries for each failed part
+        """
+        head = self.s3_cli.head_object(Bucket=bucket_name,Key=key)
+        (size, etag) = (head['ContentLength'], head['ETag'])
+        part_file = file_name + PART_SUFFIX
+        states = DiskCache('s3_resume', ttl=RESUME_TTL)
+        state_key = ['download', bucket_name, key, os.path.abspath(file_name)]
+        state = states.get(state_key)
+
+        if isNone(state) or not state['etag'] == etag or not (
+                os.path.isfile(part_file) and os.path.getsize(part_file) == size):
+            state = {'etag': etag, 'size': size,
+                     'part_size': max(self.transfer_config.multipart_chunksize, -(-size // MAX_PARTS)),
+                     'parts': []}
+            with open(part_file, 'wb') as fp:
+                fp.truncate(size)
+            states.set(state_key, state)
+
+        part_size = state['part_size']
+        done = set(state['parts'])
+        progress = TqdmProgress(total=size, desc=key)
+        progress(sum([min(part_size, size - (num - 1) * part_size) for num in done]))
+
+        def _get_range(num, callback):
+            start = (num - 1) * part_size
+            end = min(start + part_size, size) - 1
+            body = self.s3_cli.get_object(Bucket=bucket_name, Key=key, IfMatch=etag,
+                                          Range="bytes={}-{}".format(start, end))['Body']
+            with open(part_file, 'r+b') as fp:
+                fp.seek(start)
+                for buf in iter(lambda: body.read(MB), b''):
+                    fp.write(buf)
+                    callback(len(buf))
+
+        errors = []
+        num_parts = -(-size // part_size)
+        saved_at = time.time()
+        try:
+            for (num, ret, err) in parallel_map(
+                    lambda num: self._retry(retries, lambda: progress.attempt(lambda callback: _get_range(num, callback))),
+                    [num for num in range(1, num_parts + 1) if not num in done],
+                    max_workers=self.transfer_config.max_concurrency, ordered=False):
+                if isNone(err):
+                    state['parts'].append(num)
+                    # the whole state is rewritten, not once per part
+                    if time.time() - saved_at >= RESUME_SAVE_EVERY:
+                        states.set(state_key, state)
+                        saved_at = time.time()
+                else:
+                    errors.append(err)
+        finally:
+            states.set(state_key, state)
+            progress.close()
+        if len(errors) > 0:
+            print("Download of {} stopped at {}/{} parts, run it again to resume".format(
+                key, len(state['parts']), num_parts))
+            raise errors[0]
+
+        if os.path.exists(file_name):
+            os.remove(file_name)
+        os.rename(part_file, file_name)
+        states.invalidate(state_key)
+
+    def upload_stream(self,fp,bucket_name,key,buffer_parts=8,retries=2):
+        """ Upload from a binary stream, ie. stdin, without a temporary file
+
+            The stream is cut into multipart_chunksize parts, at most about
+            buffer_parts of them are held in memory while uploading. A stream
+            shorter than one part is sent with a single put_object.
+
+            :param fp           : Binary file object to read until EOF
+            :param bucket_name  : The bucket name
+            :param key          : The file name shows inside the bucket
+            :param buffer_parts : Parts kept in memory, half of them upload at the same time
+            :param retries      : Retries for each failed part
+            :return             : Bytes uploaded
+        """
+        part_size = self.transfer_config.multipart_chunksize
+        first = _read_full(fp, part_size)
+        if len(first) < part_size:
+            self._retry(retries, lambda: self.s3_cli.put_object(Bucket=bucket_name,Key=key,Body=first))
+            return len(first)
+
+        upload_id = self.s3_cli.create_multipart_upload(Bucket=bucket_name,Key=key)['UploadId']
+        progress = TqdmProgress(desc=key)
+
+        def _parts():
+            (num, body) = (1, first)
+            while len(body) > 0:
+                if num > MAX_PARTS:
+                    raise ValueError("Stream needs more than {} parts, set a larger chunksize".format(MAX_PARTS))
+                yield (num, body)
+                (num, body) = (num + 1, _read_full(fp, part_size))
+
+        def _upload_part(job):
+            (num, body) = job
+            etag = self._retry(retries, lambda: self.s3_cli.upload_part(
+                Bucket=bucket_name, Key=key, UploadId=upload_id,
+                PartNumber=num, Body=body)['ETag'])
+            progress(len(body))
+            return (etag, len(body))
+
+        parts = []
+        size = 0
+        try:
+            for ((num, body), ret, err) in parallel_map(
+                    _upload_part, _parts(), max_workers=max(1, buffer_parts // 2), ordered=False):
+                if not isNone(err):
+                    raise err
+                parts.append({'PartNumber': num, 'ETag': ret[0]})
+                size += ret[1]
+            self.s3_cli.complete_multipart_upload(
+                Bucket=bucket_name, Key=key, UploadId=upload_id,
+                MultipartUpload={'Parts': sorted(parts, key=lambda x: x['PartNumber'])})
+        except Exception:
+            self.s3_cli.abort_multipart_upload(Bucket=bucket_name,Key=key,UploadId=upload_id)
+            raise
+        finally:
+            progress.close()
+        return size
+
+    def download_stream(self,bucket_name,key,fp,buffer_parts=8,retries=2):
+        """ Write an object to a binary stream, ie. stdout, with ranged GETs fetched ahead
+
+            :param bucket_name  : The bucket name
+            :param key          : The file name shows inside the bucket
+            :param fp           : Binary file object to write to
+            :param buffer_parts : Parts kept in memory, half of them download at the same time
+            :param retries      : Retries for each failed part
+            :return             : Bytes written
+        """
+        head = self.s3_cli.head_object(Bucket=bucket_name,Key=key)
+        (size, etag) = (head['ContentLength'], head['ETag'])
+        part_size = self.transfer_config.multipart_chunksize
+        progress = TqdmProgress(total=size, desc=key)
+
+        def _get_range(start):
+            end = min(start + part_size, size) - 1
+            return self._retry(retries, lambda: self.s3_cli.get_object(
+                Bucket=bucket_name, Key=key, IfMatch=etag,
+                Range="bytes={}-{}".format(start, end))['Body'].read())
+
+        try:
+            # ordered, so parts are written as soon as every earlier part is
+            for (start, body, err) in parallel_map(
+                    _get_range, range(0, size, part_size), max_workers=max(1, buffer_parts // 2)):
+                if not isNone(err):
+                    raise err
+                fp.write(body)
+                progress(len(body))
+            fp.flush()
+        finally:
+            progress.close()
+        return size
+
+    @staticmethod
+    def _retry(retries, func):
+        for attempt in range(retries + 1):
+            try:
+                return func()
+            except TRANSFER_ERRORS:
+                if attempt == retries:
+                    raise
+                time.sleep(2 ** attempt)
+
+    def download_dir(self,bucket_name,path,prefix='',max_workers=8,retries=2):
+        """ Download keys under a prefix into path with a pool of downloaders
+
+            Keys are streamed from a paginated listing, each local directory is
+            made before any of its files is queued, and files whose size and
+            ETag already match are skipped, so a re-run only fetches changes.
+
+            :param bucket_name       : The bucket name
+            :param path              : The local directory
+            :param prefix            : Only download keys starting with prefix
+            :param max_workers       : Files downloaded at the same time
+            :param retries           : Retries for each failed file
+            :return                  : dict of files, bytes, skipped, seconds and failed [(local path, key, error)]
+        """
+        made_dirs = set()
+
+        def _objects():
+            for obj in self.iter_objects(bucket_name, prefix=prefix):
+                if obj['Key'].endswith('/'):
+                    continue
+                ff_name = os.path.join(path, obj['Key'])
+                self._mk_parent(ff_name, made_dirs)
+                yield (ff_name, obj['Key'], obj['Size'], obj)
+
+        # compared in the workers, hashing local files must not hold back the listing
+        res = self.transfer_files("download", bucket_name, _objects(), max_workers=max_workers, retries=retries,
+                                  skip=lambda job: self.is_same_file(job[0], job[3]))
+        print(self.transfer_summary("download", res) + ", {} unchanged".format(res['skipped']))
+        return res
+
+    @staticmethod
+    def _mk_parent(file_name, made_dirs):
+        check_path = os.path.dirname(file_name)
+        if not check_path in made_dirs:
+            if check_path and not os.path.isdir(check_path):
+                os.makedirs(check_path)
+            made_dirs.add(check_path)
+
+    def sync(self,path,bucket_name,prefix='',download=False,delete=False,dryrun=False,
+             manifest=False,max_workers=8,retries=2):
+        """ Sync a local directory with a bucket prefix, only new or changed files are transferred
+
+            Files are matched by their path relative to path and the key after
+            prefix, and compared by size and ETag (see is_same_file).
+
+            :param path              : The local directory
+            :param bucket_name       : The bucket name
+            :param prefix            : Keys are prefix + the path relative to the local directory
+            :param download          : Sync from the bucket to the local directory
+            :param delete            : Delete destination files which are not in the source
+            :param dryrun            : Only print what would be transferred and deleted
+            :param manifest          : Keep local file hashes in $TWCC_DATA_PATH/cache between runs
+            :param max_workers       : Files transferred at the same time
+            :param retries           : Retries for each failed file
+            :return                  : dict of files, bytes, skipped, deleted, seconds and failed
+        """
+        if not os.path.isdir(path):
+            if not download:
+                print("No such path")
+                return None
+            os.makedirs(path)
+        if prefix and not prefix.endswith('/'):
+            prefix = prefix + '/'
+
+        remote = {}
+        for obj in self.iter_objects(bucket_name, prefix=prefix):
+            if not obj['Key'].endswith('/'):
+                remote[obj['Key'][len(prefix):]] = obj
+        local = {}
+        for root,dirs,files in os.walk(path):
+            for f_name in files:
+                local_file_path = os.path.join(root, f_name)
+                local[os.path.relpath(local_file_path, path).replace(os.sep, '/')] = local_file_path
+
+        hashes = None
+        if manifest:
+            etag_cache = DiskCache('s3_manifest', ttl=MANIFEST_TTL)
+            hashes = etag_cache.get(os.path.abspath(path), {})
+
+        made_dirs = set()
+
+        def _same(job):
+            # run by the workers, hashing local files must not hold back the other jobs
+            if isNone(job[3]):
+                return False
+            try:
+                return self.is_same_file(job[0], job[3], manifest=hashes, upload=not download)
+            except (OSError, IOError):
+                # gone or unreadable since the walk, the transfer reports it
+                return False
+
+        def _changed():
+            # (local path, key, size, object or None), an upload is stat'ed in its worker
+            if download:
+                for rel in sorted(remote):
+                    local_file_path = os.path.join(path, *rel.split('/'))
+                    if not dryrun:
+                        self._mk_parent(local_file_path, made_dirs)
+                    yield (local_file_path, prefix + rel, remote[rel]['Size'], remote[rel])
+            else:
+                for rel in sorted(local):
+                    yield (local[rel], prefix + rel, None, remote.get(rel))
+
+        if download:
+            action = "download"
+            extra = [local[rel] for rel in sorted(local) if not rel in remote]
+        else:
+            action = "upload"
+            extra = [prefix + rel for rel in sorted(remote) if not rel in local]
+
+        if dryrun:
+            res = {'files': 0, 'bytes': 0, 'skipped': 0, 'failed': [], 'seconds': 0.0}
+            for job in _changed():
+                if _same(job):
+                    res['skipped'] += 1
+                    continue
+                try:
+                    size = self._job_size(job)
+                except OSError as e:
+                    res['failed'].append((job[0], job[1], e))
+                    print("ERROR during {} {} : {}".format(action, job[0], e))
+                    continue
+                print("(dryrun) {}: {} {} s3://{}/{}".format(action, job[0],
+                      "<-" if download else "->", bucket_name, job[1]))
+                res['files'] += 1
+                res['bytes'] += size
+        else:
+            res = self.transfer_files(action, bucket_name, _changed(), max_workers=max_workers, retries=retries,
+                                      skip=_same)
+
+        res['deleted'] = 0
+        if delete and len(extra) > 0:
+            if dryrun:
+                for name in extra:
+                    print("(dryrun) delete: {}".format(name if download else "s3://{}/{}".format(bucket_name, name)))
+                res['deleted'] = len(extra)
+            elif download:
+                for local_file_path in extra:
+                    try:
+                        os.remove(local_file_path)
+                        res['deleted'] += 1
+                    except OSError as e:
+                        print("ERROR during delete {} : {}".format(local_file_path, e))
+            else:
+                res['deleted'] = self.del_objects(bucket_name, extra, max_workers=max_workers)['deleted']
+
+        if manifest:
+            etag_cache.set(os.path.abspath(path), hashes)
+
+        print(self.transfer_summary(("(dryrun) " if dryrun else "") + "sync " + action, res) +
+              ", {} unchanged, {} deleted".format(res['skipped'], res['deleted']))
+        return res
+
+    def is_same_file(self,file_name,obj,manifest=None,upload=False):
+        """ Check a local file against an object from iter_objects by size and ETag
+
+            A multipart ETag can only be rebuilt when the part size matches
+            multipart_chunksize, otherwise the copy must not be older than
+            its source.
+
+            :param file_name  : Local file path
+            :param obj        : Object dict from iter_objects
+            :param manifest   : dict of {file_name: [size, mtime, chunksize, etag]}, read and updated
+                                so unchanged files are not hashed again
+            :param upload     : The local file is the source, not the copy
+        """
+        if not os.path.isfile(file_name):
+            return False
+        st = os.stat(file_name)
+        if st.st_size != obj['Size']:
+            return False
+
+        etag = obj.get('ETag', '').strip('"')
+        if not '-' in etag:
+            return self._local_etag(file_name, st, None, manifest) == etag
+
+        chunksize = self.transfer_config.multipart_chunksize
+        parts = int(etag.split('-')[1])
+        if parts == (obj['Size'] + chunksize - 1) // chunksize:
+            return self._local_etag(file_name, st, chunksize, manifest) == etag
+
+        last_modified = calendar.timegm(obj['LastModified'].utctimetuple())
+        if upload:
+            return st.st_mtime <= last_modified
+        return st.st_mtime >= last_modified
+
+    @staticmethod
+    def _local_etag(file_name, st, chunksize, manifest):
+        if isNone(manifest):
+            return file_etag(file_name, chunksize)
+        ent = manifest.get(file_name)
+        if not isNone(ent) and ent[:3] == [st.st_size, st.st_mtime, chunksize]:
+            return ent[3]
+        etag = file_etag(file_name, chunksize)
+        manifest[file_name] = [st.st_size, st.st_mtime, chunksize, etag]
+        return etag
 
     def create_bucket(self,bucket):
         """ Create an S3 bucket
@@ -165,10 +911,10 @@ class S3():
             :return: True if bucket is deleted, else False
         """
         try:
-            a = self.list_object(bucket_name)[1:]
             if y == True:
-                for i in a:
-                    self.del_object(bucket_name = bucket_name, file_name = i[2])
+                res = self.del_objects(bucket_name, (obj['Key'] for obj in self.iter_objects(bucket_name)))
+                if len(res['failed']) > 0:
+                    return False
             res = self.s3_cli.delete_bucket(Bucket = bucket_name)
             print("Successfully delete bucket :",bucket_name)
         except ClientError as e: 
@@ -195,9 +941,152 @@ class S3():
         return True
             
 
+    def copy(self,bucket_name,key,dest_bucket,dest_key,r=False,move=False,max_workers=8,retries=2):
+        """ Server-side copy or move of an object, or of every object under a prefix
+
+            No data goes through the client. With r, keys under the prefix
+            key are copied to dest_key + the rest of the key on a pool of
+            workers, and move deletes the copied sources in DeleteObjects
+            batches afterward.
+
+            :param bucket_name : The source bucket
+            :param key         : The source key, a prefix with r
+            :param dest_bucket : The destination bucket
+            :param dest_key    : The destination key, a prefix with r
+            :param r           : Copy every object under the prefix key
+            :param move        : Delete the sources which were copied
+            :param max_workers : Objects copied at the same time with r
+            :param retries     : Retries for each failed object
+            :return            : dict of files, bytes, deleted, seconds and failed [(source key, dest key, error)]
+        """
+        if r and bucket_name == dest_bucket and dest_key.startswith(key):
+            # a destination inside the source prefix would be listed and copied again
+            raise ValueError("Destination {} is inside the source {}".format(dest_key, key))
+
+        if r:
+            jobs = ((obj['Key'], dest_key + obj['Key'][len(key):], obj['Size'])
+                    for obj in self.iter_objects(bucket_name, prefix=key))
+        else:
+            jobs = [(key, dest_key, self.s3_cli.head_object(Bucket=bucket_name,Key=key)['ContentLength'])]
+
+        def _copy(job):
+            (src_key, dst_key, size) = job
+            self.copy_object(bucket_name, src_key, dest_bucket, dst_key, size, retries=retries)
+            return size
+
+        action = "move" if move else "copy"
+        copied = []
+        res = {'files': 0, 'bytes': 0, 'deleted': 0, 'failed': []}
+        start_time = time.time()
+        for ((src_key, dst_key, size), done, err) in parallel_map(
+                _copy, jobs, max_workers=max_workers, ordered=False):
+            if isNone(err):
+                res['files'] += 1
+                res['bytes'] += done
+                copied.append(src_key)
+            else:
+                res['failed'].append((src_key, dst_key, err))
+        res['seconds'] = time.time() - start_time
+
+        for (src_key, dst_key, err) in res['failed']:
+            print("ERROR during {} {} : {}".format(action, src_key, err))
+        if move and len(copied) > 0:
+            res['deleted'] = self.del_objects(bucket_name, copied, max_workers=max_workers)['deleted']
+        print(self.transfer_summary(action, res))
+        return res
+
+    def copy_object(self,bucket_name,key,dest_bucket,dest_key,size,retries=2):
+        """ Server-side copy of one object, with upload_part_copy above COPY_LIMIT
+
+            :param bucket_name : The source bucket
+            :param key         : The source key
+            :param dest_bucket : The destination bucket
+            :param dest_key    : The destination key
+            :param size        : Size of the source object
+            :param retries     : Retries for each failed request
+        """
+        source = {'Bucket': bucket_name, 'Key': key}
+        if size <= COPY_LIMIT:
+            self._retry(retries, lambda: self.s3_cli.copy_object(
+                CopySource=source, Bucket=dest_bucket, Key=dest_key))
+            return
+
+        # a multipart copy does not take the metadata along by itself
+        head = self.s3_cli.head_object(Bucket=bucket_name,Key=key)
+        upload_id = self.s3_cli.create_multipart_upload(
+            Bucket=dest_bucket, Key=dest_key, Metadata=head.get('Metadata', {}),
+            ContentType=head.get('ContentType', 'binary/octet-stream'))['UploadId']
+        part_size = max(self.transfer_config.multipart_chunksize, -(-size // MAX_PARTS))
+
+        def _copy_part(start):
+            end = min(start + part_size, size) - 1
+            return self._retry(retries, lambda: self.s3_cli.upload_part_copy(
+                CopySource=source, CopySourceIfMatch=head['ETag'],
+                CopySourceRange="bytes={}-{}".format(start, end),
+                Bucket=dest_bucket, Key=dest_key, UploadId=upload_id,
+                PartNumber=start // part_size + 1)['CopyPartResult']['ETag'])
+
+        try:
+            parts = []
+            for (start, etag, err) in parallel_map(
+                    _copy_part, range(0, size, part_size), max_workers=self.transfer_config.max_concurrency):
+                if not isNone(err):
+                    raise err
+                parts.append({'PartNumber': start // part_size + 1, 'ETag': etag})
+            self.s3_cli.complete_multipart_upload(
+                Bucket=dest_bucket, Key=dest_key, UploadId=upload_id,
+                MultipartUpload={'Parts': parts})
+        except Exception:
+            self.s3_cli.abort_multipart_upload(Bucket=dest_bucket,Key=dest_key,UploadId=upload_id)
+            raise
+
+    def del_objects(self,bucket_name,keys,max_workers=8):
+        """ Delete keys with DeleteObjects, DELETE_BATCH keys per request
+
+            :param bucket_name: Unique string name
+            :param keys       : Iterable of keys, ie. a generator over iter_objects
+            :param max_workers: DeleteObjects requests in flight at the same time
+            :return           : dict of deleted, seconds and failed [(key, error)]
+        """
+        res = {'deleted': 0, 'failed': []}
+
+        def _batches():
+            batch = []
+            for key in keys:
+                batch.append({'Key': key})
+                if len(batch) == DELETE_BATCH:
+                    yield batch
+                    batch = []
+            if len(batch) > 0:
+                yield batch
+
+        def _delete(batch):
+            # Quiet mode only returns the keys which failed
+            ret = self.s3_cli.delete_objects(Bucket=bucket_name,
+                                             Delete={'Objects': batch, 'Quiet': True})
+            return ret.get('Errors', [])
+
+        start_time = time.time()
+        for (batch, errors, err) in parallel_map(_delete, _batches(),
+                                                 max_workers=max_workers, ordered=False):
+            if isNone(err):
+                res['deleted'] += len(batch) - len(errors)
+                res['failed'].extend([(x['Key'], x['Message']) for x in errors])
+            else:
+                res['failed'].extend([(x['Key'], err) for x in batch])
+        res['seconds'] = time.time() - start_time
+
+        for (key, err) in res['failed']:
+            print("ERROR during delete {} : {}".format(key, err))
+        print("delete: {0} objects in {1:.1f} sec ({2:.1f} objects/s), {3} failed".format(
+            res['deleted'], res['seconds'], res['deleted'] / max(res['seconds'], 1e-6),
+            len(res['failed'])))
+        return res
+
     def test_table(self,table_data):
         """ Testing showing table
         """
+        from terminaltables import AsciiTable
         table = AsciiTable(table_data)
         print(table.table)
 
@@ -213,10 +1102,7 @@ class S3():
 
     def list_files_v2(self,bucket_name,delimiter='',prefix=''):
         try:
-            res = self.s3_cli.list_objects_v2(Bucket=bucket_name,Delimiter=delimiter,Prefix=prefix)
-            return [now_dict['Key'] for now_dict in res['Contents']]
-            #for now_dict in res['Contents']:
-            #    print(now_dict['Key'])
+            return [now_dict['Key'] for now_dict in self.iter_objects(bucket_name,prefix=prefix,delimiter=delimiter)]
         except ClientError as e:
             return False
         return True
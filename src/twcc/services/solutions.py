@@ -3,6 +3,7 @@ from __future__ import print_function
 from os import sys, path
 sys.path.append(path.dirname(path.abspath(__file__)))
 from generic import GenericService
+from twcc.cache import DiskCache
 
 
 class solutions(GenericService):
@@ -20,5 +21,15 @@ class solutions(GenericService):
         self._csite_ = "goc"
 
     def list(self):
-        self.ext_get = {'project': self._project_id}
-        return super(solutions, self).list()
+        """ solutions of current project, kept in DiskCache('solutions')
+        """
+        cache = DiskCache('solutions')
+        key = [self._csite_, self._project_id]
+        res = cache.get(key)
+        if res is None:
+            self.ext_get = {'project': self._project_id}
+            res = super(solutions, self).list()
+            # an error comes back as a dict, never keep it
+            if type(res) == type([]):
+                cache.set(key, res)
+        return res
@@ -3,36 +3,43 @@ import copy
 import errno
 import os
 import re
+import threading
 from twcc.util import *
-from PyInquirer import Validator, ValidationError, prompt
-from PyInquirer import style_from_dict, Token
 
 _TWCC_CLI_VERSION_="v190917"
 
-class TwccApiValidator(Validator):
-    def validate(self, document):
-        ok = re.match('^([0-9a-fA-F]{8})-([0-9a-fA-F]{4})-([0-9a-fA-F]{4})-([0-9a-fA-F]{4})-([0-9a-fA-F]{12})$', document.text)
-        if not ok:
-            raise ValidationError(
-                message='Please enter a TWCC API key',
-                cursor_position=len(document.text))  # Move cursor to end
-custom_style_2 = style_from_dict({
-    Token.Separator: '#6C6C6C',
-    Token.QuestionMark: '#FF9D00 bold',
-    #Token.Selected: '',  # default
-    Token.Selected: '#5F819D',
-    Token.Pointer: '#FF9D00 bold',
-    Token.Instruction: '',  # default
-    Token.Answer: '#5F819D bold',
-    Token.Question: '',
-})
+_API_KEY_PTN_ = re.compile('^([0-9a-fA-F]{8})-([0-9a-fA-F]{4})-([0-9a-fA-F]{4})-([0-9a-fA-F]{4})-([0-9a-fA-F]{12})$')
+
+def validate_api_key(text):
+    # PyInquirer wraps a callable into its Validator, True or the error message
+    if not _API_KEY_PTN_.match(text):
+        return 'Please enter a TWCC API key'
+    return True
+
+def custom_style_2():
+    # PyInquirer loads prompt_toolkit, only import it when a question is asked
+    from PyInquirer import style_from_dict, Token
+    return style_from_dict({
+        Token.Separator: '#6C6C6C',
+        Token.QuestionMark: '#FF9D00 bold',
+        #Token.Selected: '',  # default
+        Token.Selected: '#5F819D',
+        Token.Pointer: '#FF9D00 bold',
+        Token.Instruction: '',  # default
+        Token.Answer: '#5F819D bold',
+        Token.Question: '',
+    })
+
+def prompt(questions, **kwargs):
+    from PyInquirer import prompt as _prompt
+    return _prompt(questions, **kwargs)
 
 quest_api = [
     {
         'type': 'input',
         'name': 'TWCC_API_KEY',
         'message': "Your API Key from www.TWCC.ai",
-        'validate': TwccApiValidator
+        'validate': validate_api_key
     },
     #{
     #    'type': 'input',
@@ -118,7 +125,7 @@ class Session(object):
         PROJECT_CODE = os.environ.get('TWCC_PROJECT_CODE', '')
         valid_proj_ids = [p['id'] for p in avl_proj]
         if not PROJECT_ID or not PROJECT_CODE or int(PROJECT_ID) not in valid_proj_ids:
-            answers = prompt(quest_api, style=custom_style_2)
+            answers = prompt(quest_api, style=custom_style_2())
             PROJECT_ID = answers['default_project'].split(" - ")[0]
             PROJECT_CODE = answers['default_project'].split(" ")[3]
 
@@ -171,9 +178,9 @@ class Session(object):
 
         self.clusters = {}
         import yaml
-        config = yaml.load(open(self.yaml, 'r').read(), Loader=yaml.FullLoader)
-        self.clusters = config[ os.environ['_STAGE_'] ]['clusters']
-        del config
+        # keep the parsed resources, ServiceOperation reads 'avalible_funcs' from here
+        self.config = yaml.load(open(self.yaml, 'r').read(), Loader=yaml.FullLoader)
+        self.clusters = self.config[ os.environ['_STAGE_'] ]['clusters']
 
     def convertYaml(self, api_key, key_name):
         """
@@ -209,11 +216,21 @@ def mkdir_p(path):
         else:
             raise
 
-def session_start():
-    if not '_TWCC_SESSION_' == globals():
-        TWCC_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
-        return Session( twcc_yaml_path="{}/yaml/NCHC_API-Test_env.yaml".format(TWCC_PATH) )
-    else:
-        global _TWCC_SESSION_
+_TWCC_SESSION_ = None
+# re-entrant: creating a new session calls the API, which asks for the session again
+_TWCC_SESSION_LOCK_ = threading.RLock()
+
+def session_start(reload=False):
+    """ Get the process-wide Session, credential and resources are parsed only once
+
+    Args:
+        reload (bool): drop the current session and read the files again
+    """
+    global _TWCC_SESSION_
+    with _TWCC_SESSION_LOCK_:
+        if reload or isNone(_TWCC_SESSION_):
+            TWCC_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+            sess = Session( twcc_yaml_path="{}/yaml/NCHC_API-Test_env.yaml".format(TWCC_PATH) )
+            _TWCC_SESSION_ = sess
         return _TWCC_SESSION_
 
@@ -28,6 +28,50 @@ def strShorten(mstr, max_len=6):
 def isNone(x):
     return True if type(x) == type(None) else False
 
+def parallel_map(func, items, max_workers=8, ordered=True):
+    """ Run func(item) for every item on a thread pool
+
+    items are pulled lazily and at most 2*max_workers calls are pending,
+    so a long generator (ie. os.walk) is never fully materialized.
+
+    Args:
+        func (function): called with one item
+        items (iterable): inputs for func
+        max_workers (int): number of worker threads
+        ordered (bool): yield in the order of items, else as calls finish
+
+    Yields:
+        (item, result, error) tuples, error is the exception raised by func or None
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    from collections import deque
+
+    def _call(item):
+        try:
+            return (item, func(item), None)
+        except Exception as e:
+            return (item, None, e)
+
+    def _pop(pending):
+        if ordered:
+            return [pending.popleft().result()]
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            pending.remove(fut)
+        return [fut.result() for fut in done]
+
+    max_workers = max(1, max_workers)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for item in items:
+            pending.append(pool.submit(_call, item))
+            if len(pending) >= 2 * max_workers:
+                for res in _pop(pending):
+                    yield res
+        while len(pending) > 0:
+            for res in _pop(pending):
+                yield res
+
 def table_layout(title, json_obj, caption_row=[], debug=False, isWrap=True):
     from terminaltables import AsciiTable, SingleTable
     from colorclass import Color